@@ -0,0 +1,38 @@
+"""
+Bytes on the wire and CPU time per ingest batch, with and without compression.
+
+    python -m benchmarks.bench_compression
+"""
+import time
+import jsonpickle
+
+from lunary.compression import compress, GZIP, ZSTD, zstandard
+from benchmarks.events import make_batch
+
+ROUNDS = 20
+
+
+def measure(data: bytes, encoding: str | None):
+    if encoding is None:
+        return len(data), 0.0
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        compressed = compress(data, encoding)
+    return len(compressed), (time.process_time() - start) / ROUNDS
+
+
+def main():
+    encodings = [None, GZIP] + ([ZSTD] if zstandard is not None else [])
+    print(f"{'batch':>6} {'encoding':>9} {'bytes':>10} {'ratio':>6} {'cpu ms':>8}")
+    for size in (10, 100, 500):
+        data = jsonpickle.encode({"events": make_batch(size)}, unpicklable=False).encode("utf-8")
+        for encoding in encodings:
+            length, cpu = measure(data, encoding)
+            print(f"{size:>6} {encoding or 'none':>9} {length:>10} {len(data) / length:>6.1f} {cpu * 1000:>8.2f}")
+
+    if zstandard is None:
+        print("\nzstd skipped: `pip install zstandard` to include it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Time per call of functions decorated with `agent`, `tool`, `chain` and `class_chain`,
+against the bare function, and of `chain` as it was before the wrapped function was
+built once at decoration time.
+
+Events are tracked (start and end) but not sent: the queue discards them.
+
+    python -m benchmarks.bench_decorators
+"""
+import timeit
+from inspect import signature
+
+import lunary
+from lunary import wrap, default_input_parser
+
+CALLS = 20000
+
+
+class DiscardingQueue:
+    def append(self, event):
+        pass
+
+
+def previous_chain(name=None, input_arg=None):
+    """`chain` before this change: signature and wrap() on every call."""
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            if input_arg is not None:
+                param_names = list(signature(fn).parameters.keys())
+                input_value = None
+                if input_arg in param_names:
+                    arg_index = param_names.index(input_arg)
+                    if arg_index < len(args):
+                        input_value = args[arg_index]
+                if input_arg in kwargs:
+                    input_value = kwargs[input_arg]
+                if input_value is None:
+                    raise ValueError(f"Specified input argument '{input_arg}' not found in function call")
+                parsed_input = {"input": input_value}
+            else:
+                parsed_input = {"input": default_input_parser(*args, **kwargs)}
+            return wrap(fn, "chain", name=name or fn.__name__, input_parser=lambda *a, **kw: parsed_input)(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def answer(context, question):
+    return question
+
+
+class Agent:
+    def answer(self, context, question):
+        return question
+
+
+def main():
+    lunary.queue = DiscardingQueue()
+    lunary.get_config().app_id = "project"
+
+    agent_method = lunary.class_chain(input_arg="question")(Agent.answer)
+    instance = Agent()
+    cases = (
+        ("bare", answer),
+        ("agent", lunary.agent()(answer)),
+        ("tool", lunary.tool()(answer)),
+        ("chain", lunary.chain()(answer)),
+        ("chain(input_arg)", lunary.chain(input_arg="question")(answer)),
+        ("previous chain(input_arg)", previous_chain(input_arg="question")(answer)),
+        ("class_chain(input_arg)", lambda context, question: agent_method(instance, context, question)),
+    )
+
+    print(f"{CALLS} calls")
+    print(f"{'decorator':>26} {'us/call':>8}")
+    for name, fn in cases:
+        seconds = min(timeit.repeat(lambda: fn("context", "question"), number=CALLS, repeat=5))
+        print(f"{name:>26} {seconds / CALLS * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
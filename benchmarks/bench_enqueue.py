@@ -0,0 +1,92 @@
+"""
+Latency of `EventQueue.append` with many threads tracking events at once, while
+a consumer drains the queue.
+
+Compares the queue with a copy of its previous design, which took the lock on
+every append and skipped the drain when it lost the race for the lock.
+
+    python -m benchmarks.bench_enqueue [threads]
+"""
+import sys
+import time
+import threading
+from collections import deque
+
+from lunary.config import get_config
+from lunary.event_queue import EventQueue
+
+EVENTS_PER_THREAD = 5000
+
+
+class LockedQueue:
+    """The previous design: one lock around every append and every drain."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = deque()
+
+    def append(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def get_batch(self):
+        if self.lock.acquire(False):
+            try:
+                events = list(self.events)
+                self.events.clear()
+                return events
+            finally:
+                self.lock.release()
+        return []
+
+
+def run(queue, threads: int) -> tuple[list[int], int, int]:
+    latencies = [[] for _ in range(threads)]
+    start = threading.Barrier(threads + 1)
+    event = {"event": "start", "type": "llm", "runId": "run"}
+
+    def produce(samples):
+        start.wait()
+        for _ in range(EVENTS_PER_THREAD):
+            before = time.perf_counter_ns()
+            queue.append(event)
+            samples.append(time.perf_counter_ns() - before)
+
+    producers = [threading.Thread(target=produce, args=(samples,)) for samples in latencies]
+    for producer in producers:
+        producer.start()
+
+    drained, skipped = 0, 0
+    start.wait()
+    while any(producer.is_alive() for producer in producers):
+        batch = queue.get_batch()
+        drained += len(batch)
+        skipped += not batch
+        time.sleep(0.001)
+    drained += len(queue.get_batch())
+    return sorted(sample for samples in latencies for sample in samples), drained, skipped
+
+
+def percentile(samples: list[int], p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p))] / 1000
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    config = get_config()
+    config.max_queue_size = None
+
+    queues = {"locked": LockedQueue(), "EventQueue": EventQueue(start_consumer=False)}
+
+    print(f"{threads} threads x {EVENTS_PER_THREAD} events")
+    print(f"{'queue':>10} {'p50 us':>8} {'p99 us':>8} {'p99.9 us':>9} {'max us':>9} {'drained':>8} {'empty drains':>13}")
+    for name, queue in queues.items():
+        samples, drained, skipped = run(queue, threads)
+        print(
+            f"{name:>10} {percentile(samples, 0.5):>8.2f} {percentile(samples, 0.99):>8.2f} "
+            f"{percentile(samples, 0.999):>9.2f} {samples[-1] / 1000:>9.0f} {drained:>8} {skipped:>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
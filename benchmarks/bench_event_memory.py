@@ -0,0 +1,99 @@
+"""
+Memory held by queued events, as 21 keys dicts (the previous layout of `track_event`)
+and as Event objects, plus the time to create and serialize an event. Events are
+created when tracked and serialized later on, in the background.
+
+Each event has its own run ids and timestamp, like tracked events; the input is
+shared, so only the layout differs.
+
+    python -m benchmarks.bench_event_memory [events]
+"""
+import sys
+import gc
+import timeit
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+from lunary.events import Event, encode_event
+from lunary.serializers import create_serializer
+
+INPUT = [{"role": "user", "content": "What is the capital of France?"}]
+
+
+def fields(i: int) -> tuple:
+    return str(uuid.UUID(int=i)), str(uuid.UUID(int=i + 1)), datetime.now(timezone.utc).isoformat()
+
+
+def make_dict(run_id: str, parent_run_id: str, timestamp: str) -> dict:
+    return {
+        "event": "start",
+        "type": "llm",
+        "name": "gpt-4o",
+        "userId": None,
+        "userProps": None,
+        "tags": None,
+        "threadTags": None,
+        "runId": run_id,
+        "parentRunId": parent_run_id,
+        "timestamp": timestamp,
+        "message": None,
+        "input": INPUT,
+        "output": None,
+        "error": None,
+        "feedback": None,
+        "runtime": "lunary-py",
+        "tokensUsage": None,
+        "metadata": None,
+        "params": None,
+        "templateId": None,
+        "appId": None,
+    }
+
+
+def make_event(run_id: str, parent_run_id: str, timestamp: str) -> Event:
+    return Event(
+        event="start",
+        type="llm",
+        name="gpt-4o",
+        run_id=run_id,
+        parent_run_id=parent_run_id,
+        timestamp=timestamp,
+        input=INPUT,
+        runtime="lunary-py",
+    )
+
+
+def measure(make, count: int) -> float:
+    """Bytes allocated per event to hold `count` events in a list."""
+    gc.collect()
+    tracemalloc.start()
+    events = [make(*fields(i)) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del events
+    return size / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    serializer = create_serializer()
+    sample = 10000
+
+    print(f"{count} queued events")
+    values = [fields(i) for i in range(sample)]
+
+    print(f"{'layout':>7} {'MB':>8} {'bytes/event':>12} {'us/create':>10} {'us/serialize':>13}")
+    for name, make in (("dict", make_dict), ("Event", make_event)):
+        per_event = measure(make, count)
+        create = min(timeit.repeat(lambda: [make(*v) for v in values], number=1, repeat=5))
+        events = [make(*v) for v in values]
+        serialize = min(timeit.repeat(lambda: [encode_event(e, serializer) for e in events], number=1, repeat=5))
+        print(
+            f"{name:>7} {per_event * count / 1e6:>8.0f} {per_event:>12.0f} "
+            f"{create / sample * 1e6:>10.2f} {serialize / sample * 1e6:>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
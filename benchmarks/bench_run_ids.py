@@ -0,0 +1,60 @@
+"""
+Time spent deriving run ids while tracking a trace of 10k spans.
+
+Each span is tracked by a start and an end event, both deriving the id of the span
+and the id of its parent, as `track_event` does.
+
+    python -m benchmarks.bench_run_ids
+"""
+import timeit
+import uuid
+import hashlib
+
+from lunary.utils import derive_run_id
+
+SPANS = 10000
+PROJECT_ID = str(uuid.uuid4())
+
+
+def previous_derive_run_id(run_id: str, project_id: str) -> str:
+    """The derivation before caching, as it was done for every id of every event."""
+    sha256_hash = hashlib.sha256()
+    sha256_hash.update((run_id + project_id).encode("utf-8"))
+    return str(uuid.UUID(sha256_hash.hexdigest()[:32]))
+
+
+def make_trace() -> list[tuple[str, str | None]]:
+    """(run_id, parent_run_id) of the spans of a trace: a root with agents, each calling tools and LLMs."""
+    root = str(uuid.uuid4())
+    spans = [(root, None)]
+    while len(spans) < SPANS:
+        agent = str(uuid.uuid4())
+        spans.append((agent, root))
+        spans += [(str(uuid.uuid4()), agent) for _ in range(min(9, SPANS - len(spans)))]
+    return spans
+
+
+def track_trace(spans, derive):
+    for event in ("start", "end"):
+        for run_id, parent_run_id in spans:
+            derive(run_id, PROJECT_ID)
+            if parent_run_id is not None:
+                derive(parent_run_id, PROJECT_ID)
+
+
+def main():
+    spans = make_trace()
+    assert all(derive_run_id(run_id, PROJECT_ID) == previous_derive_run_id(run_id, PROJECT_ID) for run_id, _ in spans)
+
+    print(f"{SPANS} spans, {4 * SPANS - 2} derivations")
+    print(f"{'derivation':>10} {'ms/trace':>9}")
+    for name, derive in (("previous", previous_derive_run_id), ("cached", derive_run_id)):
+        def run():
+            derive_run_id.cache_clear()
+            track_trace(spans, derive)
+        seconds = min(timeit.repeat(run, number=1, repeat=5))
+        print(f"{name:>10} {seconds * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
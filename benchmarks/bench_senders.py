@@ -0,0 +1,91 @@
+"""
+Events/sec delivered to a local stub of the ingest endpoint, which answers after a
+fixed latency, as the number of sender workers grows.
+
+Each run tracks a start and an end event, spread across `projects` projects (1 by
+default, like a batch inference job). The events of a run are sent in order, the
+runs of a project are spread over the workers.
+
+    python -m benchmarks.bench_senders [projects]
+"""
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lunary.config import get_config
+from lunary.event_queue import EventQueue
+
+LATENCY = 0.02
+EVENTS = 40000
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.received = {}
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        events = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["events"]
+        time.sleep(LATENCY)
+        with self.server.lock:
+            for event in events:
+                self.server.received.setdefault(event["appId"], []).append((event["runId"], event["event"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def run(server, workers: int, projects: int) -> float:
+    config = get_config()
+    config.sender_workers = workers
+    server.received = {}
+    queue = EventQueue()
+
+    start = time.perf_counter()
+    for i in range(EVENTS // projects // 2):
+        for event in ("start", "end"):
+            queue.append([{"event": event, "runId": i, "appId": f"project-{p}"} for p in range(projects)])
+    while sum(len(events) for events in server.received.values()) < EVENTS:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    queue.consumer.stop()
+
+    for events in server.received.values():
+        started = set()
+        for run_id, event in events:
+            assert event == "start" or run_id in started, "end sent before start"
+            started.add(run_id)
+    return EVENTS / elapsed
+
+
+def main():
+    projects = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    server = StubServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    config = get_config()
+    config.api_url = f"http://127.0.0.1:{server.server_address[1]}"
+    config.max_batch_size = 100
+    config.http_pool_size = 32
+    config.max_queue_size = None
+
+    print(f"{EVENTS} events, {projects} projects, {LATENCY * 1000:.0f} ms per request")
+    print(f"{'workers':>8} {'events/s':>10}")
+    for workers in (1, 2, 4, 8, 16):
+        print(f"{workers:>8} {run(server, workers, projects):>10.0f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
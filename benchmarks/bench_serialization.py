@@ -0,0 +1,60 @@
+"""
+Time to serialize realistic OpenAI/LangChain events with each serializer.
+
+The OpenAI SDK returns pydantic models (e.g. tool calls), which the events keep as is.
+
+    python -m benchmarks.bench_serialization
+"""
+import random
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+
+import lunary  # registers the jsonpickle handler for pydantic models
+from lunary.serializers import SERIALIZERS, orjson
+from benchmarks.events import make_batch
+
+
+class Function(BaseModel):
+    name: str
+    arguments: str
+
+
+class ToolCall(BaseModel):
+    id: str
+    type: str
+    function: Function
+
+
+def with_models(events: list[dict]) -> list[dict]:
+    """Replaces plain tool calls with pydantic models and adds UUIDs/datetimes, as the SDKs produce them."""
+    rng = random.Random(1)
+    result = []
+    for event in events:
+        event = dict(event)
+        output = event.get("output")
+        if isinstance(output, dict) and output.get("tool_calls"):
+            event["output"] = {**output, "tool_calls": [ToolCall(**call) for call in output["tool_calls"]]}
+        event["metadata"] = {"trace": uuid.UUID(int=rng.getrandbits(128)), "received": datetime.now(timezone.utc)}
+        result.append(event)
+    return result
+
+
+def main():
+    events = with_models(make_batch(1000))
+    names = [name for name in SERIALIZERS if name != "orjson" or orjson is not None]
+    baseline = None
+
+    print(f"{'serializer':>11} {'us/event':>9} {'speedup':>8}")
+    for name in names:
+        serializer = SERIALIZERS[name]()
+        seconds = min(timeit.repeat(lambda: [serializer.dumps(e) for e in events], number=1, repeat=5))
+        per_event = seconds / len(events) * 1e6
+        baseline = baseline or per_event
+        print(f"{name:>11} {per_event:>9.1f} {baseline / per_event:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Time spent accumulating the output of a streamed chat completion, on the thread
+iterating the stream, replaying a stream of 10k chunks: 8k content deltas, then the
+arguments of 4 parallel tool calls.
+
+Chunks are replayed as objects with the attributes of the OpenAI SDK chunks, so the
+benchmark runs without the SDK or network access.
+
+    python -m benchmarks.bench_stream [chunks]
+"""
+import sys
+import timeit
+from types import SimpleNamespace as NS
+
+from lunary.streaming import StreamAccumulator
+
+TOOL_CALLS = 4
+
+
+def record(count: int) -> list:
+    """A stream of `count` chunks, mostly content, ending with parallel tool calls."""
+    def chunk(content=None, role=None, tool_calls=None):
+        delta = NS(content=content, role=role, tool_calls=tool_calls, function_call=None)
+        return NS(choices=[NS(index=0, delta=delta)], usage=None)
+
+    content_chunks = count * 4 // 5
+    chunks = [chunk(role="assistant", content="")]
+    chunks += [chunk(content=" token") for _ in range(content_chunks - 1)]
+    chunks += [
+        chunk(tool_calls=[NS(index=i, id=f"call_{i}", type="function", function=NS(name="search", arguments=""))])
+        for i in range(TOOL_CALLS)
+    ]
+    while len(chunks) < count:
+        i = len(chunks) % TOOL_CALLS
+        chunks.append(chunk(tool_calls=[NS(index=i, id=None, type=None, function=NS(name=None, arguments='"x", '))]))
+    return chunks
+
+
+def previous_accumulate(stream) -> dict:
+    """The accumulation of `default_stream_handler` before StreamAccumulator."""
+    choices = []
+    tokens = 0
+    for chunk in stream:
+        tokens += 1
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        index = choice.index
+        content = choice.delta.content
+        role = choice.delta.role
+        function_call = choice.delta.function_call
+        tool_calls = choice.delta.tool_calls
+        if len(choices) <= index:
+            choices.append({"message": {"role": role, "content": content or "", "function_call": {}, "tool_calls": []}})
+        if content:
+            choices[index]["message"]["content"] += content
+        if role:
+            choices[index]["message"]["role"] = role
+        if hasattr(function_call, "name"):
+            choices[index]["message"]["function_call"]["name"] = function_call.name
+        if hasattr(function_call, "arguments"):
+            choices[index]["message"]["function_call"].setdefault("arguments", "")
+            choices[index]["message"]["function_call"]["arguments"] += function_call.arguments
+        if isinstance(tool_calls, list):
+            for tool_call in tool_calls:
+                existing_call_index = next(
+                    (index for (index, tc) in enumerate(choices[index]["message"]["tool_calls"]) if tc.index == tool_call.index),
+                    -1,
+                )
+            if existing_call_index == -1:
+                choices[index]["message"]["tool_calls"].append(tool_call)
+            else:
+                existing_call = choices[index]["message"]["tool_calls"][existing_call_index]
+                if hasattr(tool_call, "function") and hasattr(tool_call.function, "arguments"):
+                    existing_call.function.arguments += tool_call.function.arguments
+    return choices[0]["message"]
+
+
+def accumulate(stream) -> dict:
+    accumulator = StreamAccumulator()
+    for chunk in stream:
+        accumulator.add(chunk)
+    return accumulator.message()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    assert accumulate(record(count))["content"] == previous_accumulate(record(count))["content"]
+
+    print(f"{count} chunks, {TOOL_CALLS} parallel tool calls")
+    print(f"{'accumulation':>12} {'ms/stream':>10} {'us/chunk':>9}")
+    for name, run in (("previous", previous_accumulate), ("fragments", accumulate)):
+        # The previous accumulation grows the arguments on the chunks: replay fresh ones
+        seconds = min(timeit.repeat("run(stream)", setup="stream = record(count)", number=1, repeat=5, globals={**globals(), "run": run, "count": count}))
+        print(f"{name:>12} {seconds * 1000:>10.2f} {seconds / count * 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Latency added to each chunk of a streamed chat completion by the stream handler,
+compared with iterating the stream unwrapped, in the default (parsing) mode and in
+the `chunks` and `deltas` pass-through modes.
+
+Replays the stream of benchmarks.bench_stream. Tracking is left out: the benchmark
+measures the delivery of the chunks, not the end event.
+
+    python -m benchmarks.bench_stream_overhead [chunks]
+"""
+import sys
+import timeit
+
+import lunary
+from lunary.config import get_config
+from lunary.streaming import drain_finisher
+
+from .bench_stream import record
+
+
+def consume(stream) -> None:
+    for _ in stream:
+        pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    config = get_config()
+    lunary.track_event = lambda *args, **kwargs: None
+    chunks = record(count)
+
+    def unwrapped():
+        consume(chunk for chunk in chunks)
+
+    def handled():
+        consume(lunary.default_stream_handler(lambda: (chunk for chunk in chunks), "run", "gpt-4o", "llm"))
+
+    baseline = min(timeit.repeat(unwrapped, number=1, repeat=20))
+    print(f"{count} chunks")
+    print(f"{'mode':>10} {'us/chunk':>9} {'overhead':>9}")
+    print(f"{'unwrapped':>10} {baseline / count * 1e6:>9.3f} {'':>9}")
+    for mode in (None, "chunks", "deltas"):
+        config.stream_passthrough = mode
+        seconds = min(timeit.repeat(handled, number=1, repeat=20))
+        drain_finisher(10)
+        print(f"{mode or 'parsing':>10} {seconds / count * 1e6:>9.3f} {(seconds - baseline) / count * 1e6:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
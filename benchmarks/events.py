@@ -0,0 +1,102 @@
+"""Realistic events used by the benchmarks: OpenAI chat completions with tools and LangChain chains."""
+import random
+import uuid
+from datetime import datetime, timezone
+
+WORDS = (
+    "the user wants to know about order refund shipping delay invoice account password reset "
+    "please check status of my subscription plan billing cycle thanks for your help today "
+    "I can look into that for you could you share the order number and the email address"
+).split()
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": f"Look up the {name.replace('_', ' ')} for a customer",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "order_id": {"type": "string", "description": "The order identifier"},
+                    "email": {"type": "string", "description": "The customer email address"},
+                    "include_history": {"type": "boolean", "description": "Whether to include past events"},
+                },
+                "required": ["order_id"],
+            },
+        },
+    }
+    for name in ("get_order_status", "get_invoice", "get_shipping_info", "reset_password")
+]
+
+SYSTEM_PROMPT = "You are a helpful customer support assistant for an online store. " * 20
+
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def openai_events(rng: random.Random, turns: int = 10) -> list[dict]:
+    """Start and end events of one chat completion with a conversation history and tools."""
+    run_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": text(rng, 30)})
+        messages.append({"role": "assistant", "content": text(rng, 60)})
+
+    base = {
+        "type": "llm",
+        "name": "gpt-4o",
+        "userId": "user-123",
+        "runId": run_id,
+        "runtime": "lunary-py",
+    }
+    start = {
+        **base,
+        "event": "start",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "input": messages,
+        "params": {"temperature": 0.2, "tools": TOOLS, "tool_choice": "auto"},
+        "tags": ["support", "production"],
+    }
+    end = {
+        **base,
+        "event": "end",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "output": {
+            "role": "assistant",
+            "content": text(rng, 80),
+            "tool_calls": [
+                {
+                    "id": f"call_{rng.getrandbits(64):x}",
+                    "type": "function",
+                    "function": {"name": "get_order_status", "arguments": '{"order_id": "A-1234"}'},
+                }
+            ],
+        },
+        "tokensUsage": {"prompt": 1843, "completion": 112},
+    }
+    return [start, end]
+
+
+def langchain_events(rng: random.Random) -> list[dict]:
+    """A small RAG chain: chain start, retriever start/end, chain end."""
+    chain_id, retriever_id = (str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(2))
+    common = {"runtime": "langchain-py", "timestamp": datetime.now(timezone.utc).isoformat()}
+    return [
+        {**common, "type": "chain", "event": "start", "runId": chain_id, "name": "RunnableSequence",
+         "input": {"question": text(rng, 20)}, "metadata": {"session": "abc"}},
+        {**common, "type": "retriever", "event": "start", "runId": retriever_id, "parentRunId": chain_id,
+         "input": text(rng, 20)},
+        {**common, "type": "retriever", "event": "end", "runId": retriever_id,
+         "output": [{"source": f"doc-{i}.md", "summary": text(rng, 20)} for i in range(4)]},
+        {**common, "type": "chain", "event": "end", "runId": chain_id, "output": text(rng, 120)},
+    ]
+
+
+def make_batch(size: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    events = []
+    while len(events) < size:
+        events += openai_events(rng) if rng.random() < 0.5 else langchain_events(rng)
+    return events[:size]
@@ -40,3 +40,5 @@ msg_id = thread.track_message({
 #     "comment": "I don't feel comfortable sharing my credit card number."
 # })
 
+
+lunary.flush()
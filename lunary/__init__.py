@@ -1,11 +1,12 @@
 from inspect import signature
-import traceback, logging, copy, time, chevron, aiohttp, copy
+import traceback, logging, copy, time, chevron, aiohttp, copy, asyncio
 from functools import wraps
 
 
 from packaging import version
 from importlib.metadata import PackageNotFoundError
 from contextvars import ContextVar
+import contextvars
 from datetime import datetime, timezone
 from typing import Optional, Any, Callable, Union
 import jsonpickle
@@ -15,12 +16,19 @@ import humps
 from .exceptions import *
 from .parsers import default_input_parser, default_output_parser, filter_params, method_input_parser, PydanticHandler
 from .openai_utils import OpenAIUtils
+from .streaming import StreamAccumulator, StreamProgress, StreamTimer, compact_chunk, finish_in_background, drain_finisher
 from .ibm_utils import IBMUtils
-from .event_queue import EventQueue
+from .event_queue import EventQueue, FlushResult
+from .events import Event
+from .async_consumer import AsyncConsumer
 from .thread import Thread
-from .utils import clean_nones, create_uuid_from_string
+from .utils import derive_run_id
 from .config import get_config, set_config
+from .session import get_session
+from .debug import debug_sink
 from .run_manager import RunManager
+from . import sampling
+from .tail_sampling import trace_buffer
 
 from .users import (
     user_ctx,
@@ -62,8 +70,57 @@ def config(
     verbose: str | None = None,
     api_url: str | None = None,
     disable_ssl_verify: bool | None = None,
+    **kwargs,
 ):
-    set_config(app_id, verbose, api_url, disable_ssl_verify)
+    set_config(app_id, verbose, api_url, disable_ssl_verify, **kwargs)
+    queue.open_spool()
+
+
+def flush(timeout: float = 10.0) -> FlushResult:
+    """
+    Sends all the tracked events now, from the calling thread. Use it at the end of
+    serverless handlers, Celery tasks and other short-lived workers. Traces held back
+    by tail sampling stay held until they end, unless they ran for more than
+    `tail_trace_timeout`: they may belong to other tasks still running.
+
+    Parameters:
+        timeout (float): Maximum time to spend finishing streams and sending, in seconds
+            (plus at most one in-flight HTTP request).
+
+    Returns:
+        FlushResult: Number of events sent, dropped, and still pending when the timeout expired.
+    """
+    deadline = time.monotonic() + timeout
+    drain_finisher(timeout)
+    trace_buffer.release_expired()
+    return queue.flush(max(0, deadline - time.monotonic()))
+
+
+async def aflush(timeout: float = 10.0) -> FlushResult:
+    """
+    Asynchronous version of `flush`, which sends the events without blocking the event loop.
+    """
+    deadline = time.monotonic() + timeout
+    await asyncio.to_thread(drain_finisher, timeout)
+    trace_buffer.release_expired()
+    return await queue.drain(max(0, deadline - time.monotonic()))
+
+
+def async_consumer() -> AsyncConsumer:
+    """
+    Sends the tracked events from a task on the running event loop instead of a thread.
+    Start it with `await consumer.start()` or `async with lunary.async_consumer():`,
+    e.g. in the lifespan of a FastAPI app.
+    """
+    return AsyncConsumer(queue)
+
+
+def get_queue_stats() -> dict:
+    """
+    Returns the counters of the event queue (queued, dropped and spilled events),
+    e.g. to export them to Prometheus or StatsD.
+    """
+    return queue.stats()
 
 
 def get_parent_run_id(parent_run_id: str, run_type: str, app_id: str, run_id: str):
@@ -72,13 +129,13 @@ def get_parent_run_id(parent_run_id: str, run_type: str, app_id: str, run_id: st
 
     parent_from_ctx = get_parent()
     if parent_from_ctx and run_type != "thread":
-        return str(create_uuid_from_string(str(parent_from_ctx) + str(app_id)))
+        return derive_run_id(str(parent_from_ctx), str(app_id))
 
     if parent_run_id:
-        return str(create_uuid_from_string(str(parent_run_id) + str(app_id)))
+        return derive_run_id(str(parent_run_id), str(app_id))
 
     if parent_run_id is not None:
-        return str(create_uuid_from_string(str(parent_run_id) + str(app_id)))
+        return derive_run_id(str(parent_run_id), str(app_id))
 
 
 def track_event(
@@ -105,8 +162,13 @@ def track_event(
     app_id=None, 
     api_url=None,
     callback_queue=None,
+    droppable=False,
 ):
     try:
+        if not sampling.should_track(run_id, parent_run_id, run_type, name, tags or thread_tags):
+            return
+        tracked_run_id = str(run_id)
+
         config = get_config()
         custom_app_id = app_id
         project_id = app_id or config.app_id # used to generate a unique run_id 
@@ -117,217 +179,195 @@ def track_event(
             parent_run_id, run_type, app_id=project_id, run_id=run_id
         )
         # We need to generate a UUID that is unique by run_id / project_id pair in case of multiple concurrent callback handler use
-        run_id = str(create_uuid_from_string(str(run_id) + str(project_id)))
-
-        event = {
-            "event": event_name,
-            "type": run_type,
-            "name": name,
-            "userId": user_id or user_ctx.get(),
-            "userProps": user_props or user_props_ctx.get(),
-            "tags": tags or tags_ctx.get(),
-            "threadTags": thread_tags,
-            "runId": run_id,
-            "parentRunId": parent_run_id,
-            "timestamp": timestamp or datetime.now(timezone.utc).isoformat(),
-            "message": message,
-            "input": input,
-            "output": output,
-            "error": error,
-            "feedback": feedback,
-            "runtime": runtime or "lunary-py",
-            "tokensUsage": token_usage,
-            "metadata": metadata,
-            "params": params,
-            "templateId": template_id,
-            "appId": custom_app_id, # should only be set when a custom app_id is provided, otherwise the app_id is set in consumer.py 
-        }
-
-        if callback_queue is not None:
-            callback_queue.append(event)
-        else:
-            queue.append(event)
+        run_id = derive_run_id(str(run_id), str(project_id))
+
+        event = Event(
+            event=event_name,
+            type=run_type,
+            name=name,
+            user_id=user_id or user_ctx.get(),
+            user_props=user_props or user_props_ctx.get(),
+            tags=tags or tags_ctx.get(),
+            thread_tags=thread_tags,
+            run_id=run_id,
+            parent_run_id=parent_run_id,
+            timestamp=timestamp or datetime.now(timezone.utc).isoformat(),
+            message=message,
+            input=input,
+            output=output,
+            error=error,
+            feedback=feedback,
+            runtime=runtime or "lunary-py",
+            token_usage=token_usage,
+            metadata=metadata,
+            params=params,
+            template_id=template_id,
+            app_id=custom_app_id, # should only be set when a custom app_id is provided, otherwise the app_id is set in consumer.py 
+        )
+        if api_url != config.api_url:
+            event.api_url = api_url # only used by the consumer to route the event, stripped before sending
+
+        target = callback_queue if callback_queue is not None else queue
+        run = run_manager.runs.get(tracked_run_id) if config.tail_sampling else None
+        if not config.tail_sampling or not trace_buffer.add(tracked_run_id, run and run.trace_id, event, target):
+            if droppable:
+                # Left out rather than blocking the caller or evicting other events when full
+                target.offer(event)
+            else:
+                target.append(event)
 
         if config.verbose:
-            try:
-                serialized_event = jsonpickle.encode(clean_nones(event), unpicklable=False, indent=4)
-                logger.info(
-                    f"\nAdd event: {serialized_event}\n"
-                )
-            except Exception as e:
-                logger.warning(f"Could not serialize event: {event}\n {e}")
+            debug_sink.log_event(event)
 
 
     except Exception as e:
         logger.exception("Error in `track_event`", e)
 
 
-def default_stream_handler(fn, run_id, name, type, *args, **kwargs):
+def stream_progress(run_id, name, type) -> StreamProgress | None:
+    """Progress reports of a streamed run, when `stream_progress_interval` is set."""
+    interval = get_config().stream_progress_interval
+    if interval is None:
+        return None
+
+    def emit(delta, offset):
+        track_event(
+            type,
+            "progress",
+            run_id,
+            name=name,
+            output={"role": "assistant", "content": delta},
+            metadata={"streaming": {"offset": offset}},
+            droppable=True,
+        )
+
+    return StreamProgress(emit, interval)
+
+
+def finish_passthrough_stream(run_id, name, type, captured, started_at):
+    """Tracks the end of a pass-through stream from the background, once delivered."""
+    duration = time.perf_counter() - started_at
+    context = contextvars.copy_context()
+
+    def finish():
+        accumulator = StreamAccumulator.replay(captured)
+        track_event(
+            type,
+            "end",
+            run_id,
+            name=name,
+            output=OpenAIUtils.parse_message(accumulator.message()),
+            token_usage=accumulator.token_usage(),
+            metadata={"streaming": {"durationMs": round(duration * 1000, 1), "chunks": len(captured)}},
+        )
+
+    finish_in_background(lambda: context.run(finish))
+
+
+def passthrough_stream_handler(fn, run_id, name, type, mode, *args, **kwargs):
+    """
+    Stream handler of the `stream_passthrough` modes: only keeps the chunks, or their
+    content, while the stream is delivered, and parses them in the background.
+    """
+    started_at = time.perf_counter()
+    captured = []
+    capture = captured.append
     try:
         stream = fn(*args, **kwargs)
 
-        choices = []
-        tokens = 0
+        if mode == "chunks":
+            for chunk in stream:
+                capture(chunk)
+                yield chunk
+        else:
+            for chunk in stream:
+                capture(compact_chunk(chunk))
+                yield chunk
+    finally:
+        stream.close()
 
-        for chunk in stream:
-            tokens += 1
-            if not chunk.choices:
-                # Azure
-                continue
-
-            choice = chunk.choices[0]
-            index = choice.index
-
-            content = choice.delta.content
-            role = choice.delta.role
-            function_call = choice.delta.function_call
-            tool_calls = choice.delta.tool_calls
-
-            if len(choices) <= index:
-                choices.append(
-                    {
-                        "message": {
-                            "role": role,
-                            "content": content or "",
-                            "function_call": {},
-                            "tool_calls": [],
-                        }
-                    }
-                )
+    finish_passthrough_stream(run_id, name, type, captured, started_at)
 
-            if content:
-                choices[index]["message"]["content"] += content
-
-            if role:
-                choices[index]["message"]["role"] = role
-
-            if hasattr(function_call, "name"):
-                choices[index]["message"]["function_call"]["name"] = function_call.name
-
-            if hasattr(function_call, "arguments"):
-                choices[index]["message"]["function_call"].setdefault("arguments", "")
-                choices[index]["message"]["function_call"][
-                    "arguments"
-                ] += function_call.arguments
-
-            if isinstance(tool_calls, list):
-                for tool_call in tool_calls:
-                    existing_call_index = next(
-                        (
-                            index
-                            for (index, tc) in enumerate(
-                                choices[index]["message"]["tool_calls"]
-                            )
-                            if tc.index == tool_call.index
-                        ),
-                        -1,
-                    )
 
-                if existing_call_index == -1:
-                    choices[index]["message"]["tool_calls"].append(tool_call)
+async def async_passthrough_stream_handler(fn, run_id, name, type, mode, *args, **kwargs):
+    started_at = time.perf_counter()
+    captured = []
+    capture = captured.append
+    stream = await fn(*args, **kwargs)
+
+    if mode == "chunks":
+        async for chunk in stream:
+            capture(chunk)
+            yield chunk
+    else:
+        async for chunk in stream:
+            capture(compact_chunk(chunk))
+            yield chunk
+
+    finish_passthrough_stream(run_id, name, type, captured, started_at)
+
 
-                else:
-                    existing_call = choices[index]["message"]["tool_calls"][
-                        existing_call_index
-                    ]
-                    if hasattr(tool_call, "function") and hasattr(
-                        tool_call.function, "arguments"
-                    ):
-                        existing_call.function.arguments += tool_call.function.arguments
+def default_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    passthrough = get_config().stream_passthrough
+    if passthrough is not None:
+        return passthrough_stream_handler(fn, run_id, name, type, passthrough, *args, **kwargs)
+    return parsing_stream_handler(fn, run_id, name, type, *args, **kwargs)
+
+
+def parsing_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    try:
+        accumulator = StreamAccumulator(stream_progress(run_id, name, type))
+        stream = fn(*args, **kwargs)
 
+        for chunk in stream:
+            accumulator.add(chunk)
             yield chunk
     finally:
         stream.close()
 
-    output = OpenAIUtils.parse_message(choices[0]["message"])
+    output = OpenAIUtils.parse_message(accumulator.message())
     track_event(
         type,
         "end",
         run_id,
         name=name,
         output=output,
-        token_usage={"completion": tokens, "prompt": None},
+        token_usage=accumulator.token_usage(),
+        metadata=accumulator.metadata(),
     )
     return
 
 
-async def async_stream_handler(fn, run_id, name, type, *args, **kwargs):
-    stream = await fn(*args, **kwargs)
+def async_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    passthrough = get_config().stream_passthrough
+    if passthrough is not None:
+        return async_passthrough_stream_handler(fn, run_id, name, type, passthrough, *args, **kwargs)
+    return async_parsing_stream_handler(fn, run_id, name, type, *args, **kwargs)
 
-    choices = []
-    tokens = 0
 
-    async for chunk in stream:
-        tokens += 1
-        if not chunk.choices:
-            # Happens with Azure
-            continue
-
-        choice = chunk.choices[0]
-        index = choice.index
-
-        content = choice.delta.content
-        role = choice.delta.role
-        tool_calls = choice.delta.tool_calls
-
-        if len(choices) <= index:
-            choices.append(
-                {
-                    "message": {
-                        "role": role,
-                        "content": content or "",
-                        "function_call": {},
-                        "tool_calls": [],
-                    }
-                }
-            )
-
-        if content:
-            choices[index]["message"]["content"] += content
-
-        if role:
-            choices[index]["message"]["role"] = role
-
-        if isinstance(tool_calls, list):
-            for tool_call in tool_calls:
-                existing_call_index = next(
-                    (
-                        index
-                        for (index, tc) in enumerate(
-                            choices[index]["message"]["tool_calls"]
-                        )
-                        if tc.index == tool_call.index
-                    ),
-                    -1,
-                )
-
-            if existing_call_index == -1:
-                choices[index]["message"]["tool_calls"].append(tool_call)
-
-            else:
-                existing_call = choices[index]["message"]["tool_calls"][
-                    existing_call_index
-                ]
-                if hasattr(tool_call, "function") and hasattr(
-                    tool_call.function, "arguments"
-                ):
-                    existing_call.function.arguments += tool_call.function.arguments
+async def async_parsing_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    accumulator = StreamAccumulator(stream_progress(run_id, name, type))
+    stream = await fn(*args, **kwargs)
 
+    async for chunk in stream:
+        accumulator.add(chunk)
         yield chunk
 
-    output = OpenAIUtils.parse_message(choices[0]["message"])
+    output = OpenAIUtils.parse_message(accumulator.message())
     track_event(
         type,
         "end",
         run_id,
         name=name,
         output=output,
-        token_usage={"completion": tokens, "prompt": None},
+        token_usage=accumulator.token_usage(),
+        metadata=accumulator.metadata(),
     )
     return
 
 def ibm_stream_handler(fn, run_id, name, type, *args, **kwargs):
     try:
+        timer = StreamTimer()
         stream = fn(*args, **kwargs)
 
         content = ""
@@ -340,6 +380,8 @@ def ibm_stream_handler(fn, run_id, name, type, *args, **kwargs):
             completion_tokens = chunk['usage'].get('completion_tokens', 0)
 
             delta = chunk['choices'][0]['delta']
+            if delta.get('content') or delta.get('tool_calls'):
+                timer.tick()
             content += delta.get('content', '')
 
             if 'tool_calls' in delta:
@@ -375,11 +417,18 @@ def ibm_stream_handler(fn, run_id, name, type, *args, **kwargs):
         run_id,
         name=name,
         output=output,
-        token_usage=token_usage
+        token_usage=token_usage,
+        metadata={"streaming": timer.metrics()},
     )
     return
 
 
+def strip_tracking_kwargs(kwargs):
+    """Removes the arguments meant for tracking, which unsampled runs skip."""
+    for key in ("metadata", "user_id", "user_props", "tags"):
+        kwargs.pop(key, None)
+
+
 def wrap(
     fn,
     type=None,
@@ -396,13 +445,16 @@ def wrap(
 ):
     def sync_wrapper(*args, **kwargs):
         output = None
-        nonlocal stream
-        stream = stream or kwargs.get("stream", False)
+        is_stream = stream or kwargs.get("stream", False)
 
         parent_run_id = kwargs.pop("parent", run_manager.current_run_id) 
-        run = run_manager.start_run(run_id, parent_run_id)
+        run = run_manager.start_run(run_id, parent_run_id, type, name, kwargs.get("tags") or tags or tags_ctx.get())
 
         try:
+            if not run.sampled:
+                strip_tracking_kwargs(kwargs)
+                return fn(*args, **kwargs)
+
             try:
                 params = filter_params(kwargs)
                 metadata = kwargs.pop("metadata", None)
@@ -432,7 +484,7 @@ def wrap(
             except Exception as e:
                 logging.exception(e)
 
-            if stream == True:
+            if is_stream == True:
                 return stream_handler(
                     fn, run.id, name or parsed_input["name"], type, *args, **kwargs
                 )
@@ -453,7 +505,7 @@ def wrap(
                 raise e
 
             try:
-                parsed_output = output_parser(output, stream)
+                parsed_output = output_parser(output, is_stream)
 
                 track_event(
                     type,
@@ -495,10 +547,14 @@ def async_wrap(
             output = None
 
             parent_run_id = kwargs.pop("parent", run_manager.current_run_id) 
-            run = run_manager.start_run(parent_run_id=parent_run_id)
+            run = run_manager.start_run(None, parent_run_id, type, name, kwargs.get("tags") or tags or tags_ctx.get())
 
 
             try:
+                if not run.sampled:
+                    strip_tracking_kwargs(kwargs)
+                    return await fn(*args, **kwargs)
+
                 try:
                     params = filter_params(kwargs)
                     metadata = kwargs.pop("metadata", None)
@@ -568,9 +624,13 @@ def async_wrap(
 
         def async_stream_wrapper(*args, **kwargs):
             parent_run_id = kwargs.pop("parent", run_manager.current_run_id) 
-            run = run_manager.start_run(parent_run_id=parent_run_id)
+            run = run_manager.start_run(None, parent_run_id, type, name, kwargs.get("tags") or tags or tags_ctx.get())
 
             try:
+                if not run.sampled:
+                    strip_tracking_kwargs(kwargs)
+                    return fn(*args, **kwargs)
+
                 try:
                     params = filter_params(kwargs)
                     metadata = kwargs.pop("metadata", None)
@@ -606,9 +666,8 @@ def async_wrap(
             finally:
                 run_manager.end_run(run.id)
 
-        nonlocal stream
-        stream = stream or kwargs.get("stream", False)
-        if stream == True:
+        is_stream = stream or kwargs.get("stream", False)
+        if is_stream == True:
             return async_stream_wrapper(*args, **kwargs)
         else:
             return await async_wrapper(*args, **kwargs)
@@ -694,6 +753,26 @@ def agent(name=None, user_id=None, user_props=None, tags=None, app_id=None):
 
     return decorator
 
+def input_arg_resolver(fn, input_arg: str, skip_self: bool = False):
+    """
+    Returns a function finding the value of the `input_arg` argument in the arguments
+    of a call to `fn`. The signature of `fn` is only inspected once, here.
+    """
+    param_names = list(signature(fn).parameters.keys())
+    if skip_self:
+        param_names = param_names[1:]
+    arg_index = param_names.index(input_arg) if input_arg in param_names else None
+
+    def resolve(args, kwargs):
+        if input_arg in kwargs:
+            return kwargs[input_arg]
+        if arg_index is not None and arg_index < len(args):
+            return args[arg_index]
+        return None
+
+    return resolve
+
+
 def chain(
     name: Optional[str] = None,
     user_id: Optional[str] = None,
@@ -703,42 +782,31 @@ def chain(
     input_arg: Optional[str] = None
 ):
     def decorator(fn):
+        if input_arg is None:
+            input_parser = lambda *a, **kw: {"input": default_input_parser(*a, **kw)}
+        else:
+            resolve = input_arg_resolver(fn, input_arg)
+            input_parser = lambda *a, **kw: {"input": resolve(a, kw)}
+
+        wrapped = wrap(
+            fn,
+            "chain",
+            name=name or fn.__name__,
+            user_id=user_id,
+            user_props=user_props,
+            tags=tags,
+            input_parser=input_parser,
+            app_id=app_id
+        )
+        if input_arg is None:
+            return wraps(fn)(wrapped)
+
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            if input_arg is not None:
-                from inspect import signature
-                sig = signature(fn)
-                param_names = list(sig.parameters.keys())
-                
-                input_value = None
-                
-                if input_arg in param_names:
-                    arg_index = param_names.index(input_arg)
-                    if arg_index < len(args):
-                        input_value = args[arg_index]
-                
-                if input_arg in kwargs:
-                    input_value = kwargs[input_arg]
-                
-                if input_value is None:
-                    raise ValueError(f"Specified input argument '{input_arg}' not found in function call")
-                
-                parsed_input = {"input": input_value}
-            else:
-                raw_input = default_input_parser(*args, **kwargs)
-                parsed_input = {"input": raw_input}
-            
-            return wrap(
-                fn,
-                "chain",
-                name=name or fn.__name__,
-                user_id=user_id,
-                user_props=user_props,
-                tags=tags,
-                input_parser=lambda *a, **kw: parsed_input,
-                app_id=app_id
-            )(*args, **kwargs)
-        
+            if resolve(args, kwargs) is None:
+                raise ValueError(f"Specified input argument '{input_arg}' not found in function call")
+            return wrapped(*args, **kwargs)
+
         return wrapper
     return decorator
 
@@ -751,42 +819,39 @@ def class_chain(
     input_arg: Optional[str] = None
 ):
     def decorator(fn):
+        if input_arg is None:
+            input_parser = lambda self, *a, **kw: {"input": method_input_parser(self, *a, **kw)}
+        else:
+            resolve = input_arg_resolver(fn, input_arg, skip_self=True)
+            input_parser = lambda self, *a, **kw: {"input": resolve(a, kw)}
+
+        # Wrapped once per app id, a single time unless it depends on the instance
+        wrapped_by_app_id = {}
+
+        def wrapped_for(actual_app_id):
+            wrapped = wrapped_by_app_id.get(actual_app_id)
+            if wrapped is None:
+                wrapped = wrapped_by_app_id[actual_app_id] = wrap(
+                    fn,
+                    "chain",
+                    name=name or fn.__name__,
+                    user_id=user_id,
+                    user_props=user_props,
+                    tags=tags,
+                    input_parser=input_parser,
+                    app_id=actual_app_id
+                )
+            return wrapped
+
+        wrapped = None if callable(app_id) else wrapped_for(app_id)
+
         @wraps(fn)
         def wrapper(self, *args, **kwargs):
-            actual_app_id = app_id(self) if callable(app_id) else app_id
-
-            if input_arg is not None:
-                sig = signature(fn)
-                param_names = list(sig.parameters.keys())[1:]  # Skip 'self'
-                
-                input_value = None
-                
-                if input_arg in param_names:
-                    arg_index = param_names.index(input_arg)
-                    if arg_index < len(args):
-                        input_value = args[arg_index]
-                
-                if input_arg in kwargs:
-                    input_value = kwargs[input_arg]
-                
-                if input_value is None:
-                    raise ValueError(f"Specified input argument '{input_arg}' not found in method call")
-                
-                parsed_input = {"input": input_value}
-                custom_parser = lambda self, *a, **kw: parsed_input
-            else:
-                custom_parser = lambda self, *a, **kw: {"input": method_input_parser(self, *a, **kw)}
-
-            return wrap(
-                fn,
-                "chain",
-                name=name or fn.__name__,
-                user_id=user_id,
-                user_props=user_props,
-                tags=tags,
-                input_parser=custom_parser,
-                app_id=actual_app_id
-            )(self, *args, **kwargs)
+            if input_arg is not None and resolve(args, kwargs) is None:
+                raise ValueError(f"Specified input argument '{input_arg}' not found in method call")
+            if wrapped is not None:
+                return wrapped(self, *args, **kwargs)
+            return wrapped_for(app_id(self))(self, *args, **kwargs)
         return wrapper
     return decorator
 
@@ -1064,7 +1129,9 @@ try:
             try:
                 if parent_run_id is None:
                     parent_run_id = run_manager.current_run_id
-                run = run_manager.start_run(run_id, parent_run_id)
+                run = run_manager.start_run(run_id, parent_run_id, "llm", None, tags)
+                if not run.sampled:
+                    return
 
                 user_id = _get_user_id(metadata)
                 user_props = _get_user_props(metadata)
@@ -1123,7 +1190,9 @@ try:
             try:
                 if parent_run_id is None:
                     parent_run_id = run_manager.current_run_id
-                run = run_manager.start_run(run_id, parent_run_id)
+                run = run_manager.start_run(run_id, parent_run_id, "llm", None, tags)
+                if not run.sampled:
+                    return
 
                 user_id = _get_user_id(metadata)
                 user_props = _get_user_props(metadata)
@@ -1178,6 +1247,8 @@ try:
         ) -> None:
             try:
                 run_id = run_manager.end_run(run_id)
+                if run_id in sampling.unsampled_runs:
+                    return
 
                 token_usage = (response.llm_output or {}).get("token_usage", {})
                 parsed_output: Any = [
@@ -1224,7 +1295,9 @@ try:
             try:
                 if parent_run_id is None:
                     parent_run_id = run_manager.current_run_id
-                run = run_manager.start_run(run_id, parent_run_id)
+                run = run_manager.start_run(run_id, parent_run_id, "tool", None, tags)
+                if not run.sampled:
+                    return
 
                 user_id = _get_user_id(metadata)
                 user_props = _get_user_props(metadata)
@@ -1288,7 +1361,9 @@ try:
             try:
                 if parent_run_id is None:
                     parent_run_id = run_manager.current_run_id
-                run = run_manager.start_run(run_id, parent_run_id)
+                run = run_manager.start_run(run_id, parent_run_id, None, name, tags)
+                if not run.sampled:
+                    return
 
                 if name is None and serialized:
                     name = (
@@ -1345,6 +1420,8 @@ try:
         ) -> Any:
             try:
                 run_id = run_manager.end_run(run_id)
+                if run_id in sampling.unsampled_runs:
+                    return
 
                 output = _parse_output(outputs)
 
@@ -1471,7 +1548,9 @@ try:
             try:
                 if parent_run_id is None:
                     parent_run_id = run_manager.current_run_id
-                run = run_manager.start_run(run_id, parent_run_id)
+                run = run_manager.start_run(run_id, parent_run_id, "retriever", name, kwargs.get("tags"))
+                if not run.sampled:
+                    return
 
                 user_id = _get_user_id(kwargs.get("metadata"))
                 user_props = _get_user_props(kwargs.get("metadata"))
@@ -1579,7 +1658,7 @@ def open_thread(id: Optional[str] = None, tags: Optional[List[str]] = None, app_
         if not token:
             raise ThreadError("API token is required")
 
-        return Thread(track_event=track_event, id=id, tags=tags, user_id=user_id, user_props=user_props)
+        return Thread(track_event=track_event, id=id, tags=tags, user_id=user_id, user_props=user_props, app_id=app_id)
     except Exception as e:
         raise ThreadError(f"Error opening thread: {str(e)}")
 
@@ -1641,7 +1720,7 @@ def get_raw_template(slug: str, app_id: str | None = None, api_url: str | None =
             return cache_entry["data"]
 
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        response = requests.get(
+        response = get_session().get(
             f"{base_url}/v1/template_versions/latest?slug={slug}",
             headers=headers,
             verify=config.ssl_verify,
@@ -1918,7 +1997,7 @@ def get_live_templates(app_id: str | None = None, api_url: str | None = None):
             "Content-Type": "application/json",
         }
 
-        response = requests.get(
+        response = get_session().get(
             url=f"{api_url}/v1/templates/latest",
             headers=headers,
             verify=config.ssl_verify,
@@ -1964,7 +2043,7 @@ def get_dataset(slug: str, app_id: str | None = None, api_url: str | None = None
             "Content-Type": "application/json",
         }
         
-        response = requests.get(url, headers=headers, verify=config.ssl_verify)
+        response = get_session().get(url, headers=headers, verify=config.ssl_verify)
         if not response.ok:
             raise DatasetError(f"Error fetching dataset: {response.status_code}")
 
@@ -1993,6 +2072,7 @@ def score(run_id: str, label: str, value: int | float | str | bool, comment: str
         config = get_config()
         token = app_id or config.app_id
         api_url = api_url or config.api_url
+        trace_buffer.flag(str(run_id))
 
         url = f"{api_url}/v1/runs/{run_id}/score"
         headers = {
@@ -2006,7 +2086,7 @@ def score(run_id: str, label: str, value: int | float | str | bool, comment: str
             **({"comment": comment} if comment else {}),
         }
 
-        response = requests.patch(url, headers=headers, json=data, verify=config.ssl_verify)
+        response = get_session().patch(url, headers=headers, json=data, verify=config.ssl_verify)
         
         if response.status_code == 500:
             error_message = response.json().get("message", "Unknown error")
@@ -2073,7 +2153,7 @@ def evaluate(
             **({"tags": tags} if tags else {})
         }
 
-        response = requests.post(url, headers=headers, json=data, verify=config.ssl_verify)
+        response = get_session().post(url, headers=headers, json=data, verify=config.ssl_verify)
         
         if response.status_code == 500:
             error_message = response.json().get("message", "Unknown error")
@@ -0,0 +1,208 @@
+import time
+import asyncio
+import logging
+import aiohttp
+from .config import get_config
+from .consumer import BaseConsumer, Consumer, COMPRESSION_REJECTED_STATUSES
+from .compression import compress
+from .event_queue import FlushResult, FLUSH_RETRY_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConsumer(BaseConsumer):
+    """
+    Sends the events of an EventQueue from a task on the running event loop, with
+    aiohttp, instead of the Consumer thread. Meant for applications that already run
+    an event loop, e.g. in a FastAPI lifespan:
+
+        async with lunary.async_consumer():
+            yield
+
+    While it runs, the queue does not start its Consumer thread. Compression, when
+    enabled, runs in the loop's default executor so it does not block the loop.
+    """
+
+    def __init__(self, event_queue, app_id=None):
+        super().__init__(event_queue, app_id)
+        self.loop = None
+        self.task = None
+        self.session = None
+        self.ready = None
+        self.sending = None
+        self.previous_start_consumer = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self) -> None:
+        if self.task is not None:
+            return
+        config = get_config()
+        queue = self.event_queue
+
+        if queue.consumer.is_alive():
+            # Hand over from the thread, which sends what it holds before exiting
+            await asyncio.to_thread(queue.consumer.stop)
+            queue.consumer = Consumer(queue)
+
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        self.sending = asyncio.Lock()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.http_pool_size, ssl=config.ssl_verify),
+            timeout=aiohttp.ClientTimeout(total=config.http_timeout),
+        )
+        self.running = True
+        with queue.lock:
+            self.previous_start_consumer = queue.start_consumer
+            queue.start_consumer = False
+            queue.async_consumer = self
+            queue.waker = self.wake
+        self.task = self.loop.create_task(self.run(), name="lunary-consumer")
+
+    async def stop(self) -> None:
+        """Stops the task after sending the queued events, and gives the queue back to the Consumer thread."""
+        if self.task is None:
+            return
+        self.running = False
+        self.ready.set()
+        await self.task
+        self.task = None
+
+        queue = self.event_queue
+        with queue.lock:
+            queue.waker = None
+            queue.async_consumer = None
+            queue.start_consumer = self.previous_start_consumer
+        await self.session.close()
+        queue.sync()
+
+    def wake(self) -> None:
+        """Called by the queue, possibly from another thread, when a batch may be due."""
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            # The loop was closed without stopping the consumer, tracking must not fail
+            pass
+
+    async def run(self) -> None:
+        while self.running:
+            await self.wait_for_batch()
+            if not self.running:
+                break
+            await self.send_batch()
+            if self.backing_off:
+                # The events were requeued: do not spin on them until the API recovers
+                try:
+                    await asyncio.wait_for(self.ready.wait(), get_config().flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        await self.send_batch()
+
+    async def wait_for_batch(self) -> None:
+        config = get_config()
+        while self.running:
+            # Cleared before checking, so a wake up in between is not missed
+            self.ready.clear()
+            with self.event_queue.lock:
+                delay = self.event_queue.flush_delay(config)
+            if delay is not None and delay <= 0:
+                return
+            try:
+                await asyncio.wait_for(self.ready.wait(), delay)
+            except asyncio.TimeoutError:
+                return
+
+    async def flush(self, timeout: float):
+        """Sends the queued events, see `EventQueue.flush`."""
+        queue = self.event_queue
+        deadline = time.monotonic() + timeout
+        sent, dropped = queue.sent, queue.dropped
+
+        if queue.encoder is not None:
+            await asyncio.to_thread(queue.encoder.drain, max(0, deadline - time.monotonic()))
+
+        while True:
+            before = queue.sent
+            await self.send_batch()
+            if len(queue) == 0 or time.monotonic() >= deadline:
+                break
+            if queue.sent == before:
+                await asyncio.sleep(max(0, min(FLUSH_RETRY_INTERVAL, deadline - time.monotonic())))
+
+        return FlushResult(sent=queue.sent - sent, dropped=queue.dropped - dropped, pending=len(queue))
+
+    async def send_batch(self) -> None:
+        async with self.sending:
+            config = get_config()
+            # Reading and committing the spool are file operations: kept off the event loop
+            batch = await asyncio.to_thread(self.take_batch)
+            if len(batch) > 0:
+                groups = self.group_batch(batch, config)
+                results = await asyncio.gather(
+                    *(self.send_group(route, events, config) for route, events in groups.items())
+                )
+                await asyncio.to_thread(self.finish_batch, [event for failed in results for event in failed])
+
+    async def send_group(self, route, events, config) -> list:
+        """Sends the events of one project, returns the ones that should be retried."""
+        token, api_url = route
+        breaker = self.check_route(route, events, config)
+        if breaker is None:
+            return []
+        if not breaker.ready():
+            return events
+
+        if config.verbose:
+            logger.info(f"Sending {len(events)} events to {api_url}.")
+
+        failed = []
+        chunks = self.chunk_batch(events, config)
+        for chunk in chunks:
+            if not breaker.acquire():
+                failed += [event for rest in [chunk, *chunks] for event in rest]
+                break
+            try:
+                failed += await self.send_chunk(chunk, token, api_url, breaker, config)
+            except Exception as e:
+                breaker.record_failure()
+                self.log_send_error(e, config)
+                failed += [event for rest in [chunk, *chunks] for event in rest]
+                break
+        return failed
+
+    async def send_chunk(self, chunk, token, api_url, breaker, config) -> list:
+        """See `Consumer.send_chunk`."""
+        data, encoding = self.make_payload(chunk, api_url, config)
+        status, headers, text = await self.post(data, token, api_url, encoding, config)
+
+        if encoding and status in COMPRESSION_REJECTED_STATUSES:
+            status, headers, text = await self.post(data, token, api_url, None, config)
+            if status < 400:
+                self.disable_compression(api_url, encoding)
+
+        retry = self.handle_response(chunk, status, headers, text, breaker, config)
+        if retry is not None:
+            return retry
+
+        middle = len(chunk) // 2
+        return (await self.send_chunk(chunk[:middle], token, api_url, breaker, config)
+                + await self.send_chunk(chunk[middle:], token, api_url, breaker, config))
+
+    async def post(self, data: bytes, token, api_url, encoding, config) -> tuple:
+        headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+        if encoding:
+            data = await self.loop.run_in_executor(None, compress, data, encoding)
+            headers['Content-Encoding'] = encoding
+
+        async with self.session.post(api_url + "/v1/runs/ingest", data=data, headers=headers) as response:
+            return response.status, response.headers, await response.text()
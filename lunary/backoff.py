@@ -0,0 +1,79 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with "equal jitter": half of the delay is fixed, half is random."""
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parses a `Retry-After` header, given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Spaces out requests to an endpoint that keeps failing.
+
+    Every failure delays the next attempt with exponential backoff (or by the
+    `Retry-After` the server asked for). After `failure_threshold` consecutive failures
+    the breaker opens: nothing is sent until the delay expires, then a single probe
+    request is let through (half-open). The breaker closes again on the first success.
+    """
+
+    def __init__(self, failure_threshold: int = 5, base_delay: float = 0.5, max_delay: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = CLOSED
+        self.failures = 0
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+
+    def ready(self) -> bool:
+        """Whether a request may be attempted now. Does not change the state."""
+        with self.lock:
+            return self.state != HALF_OPEN and time.monotonic() >= self.retry_at
+
+    def acquire(self) -> bool:
+        """Same as `ready`, but takes the single probe slot when the breaker is open."""
+        with self.lock:
+            if self.state == HALF_OPEN or time.monotonic() < self.retry_at:
+                return False
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.retry_at = 0.0
+
+    def record_failure(self, retry_after: float | None = None) -> None:
+        with self.lock:
+            self.failures += 1
+            delay = backoff_delay(self.failures, self.base_delay, self.max_delay)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            self.retry_at = time.monotonic() + delay
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
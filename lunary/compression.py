@@ -0,0 +1,39 @@
+import gzip
+import logging
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSIONS = (GZIP, ZSTD)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_local = threading.local()
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_compression(compression: str | None) -> str | None:
+    """Returns the encoding to use, falling back to gzip when zstd is not installed."""
+    if compression == ZSTD and zstandard is None:
+        logger.warning("zstd compression requires the `zstandard` package (`pip install zstandard`), using gzip instead")
+        return GZIP
+    return compression
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == GZIP:
+        # Level 6 compresses nearly as well as 9 on JSON, at a fraction of the CPU
+        return gzip.compress(data, compresslevel=6)
+    if encoding == ZSTD:
+        # Compressors are not thread-safe, keep one per sender thread
+        compressor = getattr(_local, "zstd", None)
+        if compressor is None:
+            compressor = _local.zstd = zstandard.ZstdCompressor(level=3)
+        return compressor.compress(data)
+    raise ValueError(f"Unsupported compression {encoding!r}, expected one of {', '.join(COMPRESSIONS)}")
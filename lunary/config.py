@@ -1,7 +1,40 @@
 import os
+import tempfile
 import threading
+from .compression import COMPRESSIONS
+from .serializers import Serializer, create_serializer
 
 DEFAULT_API_URL = "https://api.lunary.ai"
+DEFAULT_HTTP_POOL_SIZE = 10
+DEFAULT_HTTP_TIMEOUT = 10
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_QUEUE_BLOCK_TIMEOUT = 1.0
+DEFAULT_MAX_BATCH_SIZE = 500
+DEFAULT_MAX_BATCH_BYTES = 5 * 1024 * 1024
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 60.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_COMPRESSION_MIN_BYTES = 1024
+DEFAULT_FLUSH_AT = 100
+DEFAULT_FLUSH_BYTES = 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_SPILL_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_SPOOL_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_SPOOL_FSYNC_INTERVAL = 1.0
+DEFAULT_SENDER_WORKERS = 4
+DEFAULT_DEBUG_RATE_LIMIT = 10.0
+DEFAULT_SAMPLING_CACHE_SIZE = 100000
+DEFAULT_TAIL_MAX_EVENTS = 10000
+DEFAULT_TAIL_TRACE_TIMEOUT = 300.0
+SAMPLING_RULE_KINDS = ("name", "tag", "type")
+STREAM_PASSTHROUGH_MODES = ("chunks", "deltas")
+
+# What the EventQueue does with new events once it is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+SPILL = "spill"
+QUEUE_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL)
 
 class Config:
     _instance = None
@@ -24,20 +57,140 @@ class Config:
             self.verbose = verbose if verbose is not None else os.getenv('LUNARY_VERBOSE') is not None 
             self.api_url = api_url or os.getenv("LUNARY_API_URL") or DEFAULT_API_URL
             self.ssl_verify = not (disable_ssl_verify if disable_ssl_verify is not None else (True if os.environ.get("DISABLE_SSL_VERIFY") == "True" else False))
+            self.http_pool_size = int(os.getenv("LUNARY_HTTP_POOL_SIZE", DEFAULT_HTTP_POOL_SIZE))
+            self.http_timeout = float(os.getenv("LUNARY_HTTP_TIMEOUT", DEFAULT_HTTP_TIMEOUT))
+            self.max_queue_size = int(os.getenv("LUNARY_MAX_QUEUE_SIZE", DEFAULT_MAX_QUEUE_SIZE))
+            self.max_queue_bytes = int(os.environ["LUNARY_MAX_QUEUE_BYTES"]) if os.getenv("LUNARY_MAX_QUEUE_BYTES") else None
+            self.queue_policy = _check_queue_policy(os.getenv("LUNARY_QUEUE_POLICY", DROP_OLDEST))
+            self.queue_block_timeout = float(os.getenv("LUNARY_QUEUE_BLOCK_TIMEOUT", DEFAULT_QUEUE_BLOCK_TIMEOUT))
+            self.spill_dir = os.getenv("LUNARY_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "lunary")
+            self.spill_max_bytes = int(os.getenv("LUNARY_SPILL_MAX_BYTES", DEFAULT_SPILL_MAX_BYTES))
+            self.max_batch_size = int(os.getenv("LUNARY_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE))
+            self.max_batch_bytes = int(os.getenv("LUNARY_MAX_BATCH_BYTES", DEFAULT_MAX_BATCH_BYTES))
+            self.retry_base_delay = float(os.getenv("LUNARY_RETRY_BASE_DELAY", DEFAULT_RETRY_BASE_DELAY))
+            self.retry_max_delay = float(os.getenv("LUNARY_RETRY_MAX_DELAY", DEFAULT_RETRY_MAX_DELAY))
+            self.breaker_threshold = int(os.getenv("LUNARY_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD))
+            self.compression = _check_compression(os.getenv("LUNARY_COMPRESSION") or None)
+            self.compression_min_bytes = int(os.getenv("LUNARY_COMPRESSION_MIN_BYTES", DEFAULT_COMPRESSION_MIN_BYTES))
+            self.serializer = create_serializer(os.getenv("LUNARY_SERIALIZER") or None)
+            self.serialize_on_enqueue = os.getenv("LUNARY_SERIALIZE_ON_ENQUEUE") is not None
+            self.flush_at = int(os.getenv("LUNARY_FLUSH_AT", DEFAULT_FLUSH_AT))
+            self.flush_bytes = int(os.getenv("LUNARY_FLUSH_BYTES", DEFAULT_FLUSH_BYTES))
+            self.flush_interval = float(os.getenv("LUNARY_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL))
+            self.sender_workers = int(os.getenv("LUNARY_SENDER_WORKERS", DEFAULT_SENDER_WORKERS))
+            self.debug_sample_rate = float(os.getenv("LUNARY_DEBUG_SAMPLE_RATE", 1.0))
+            self.debug_rate_limit = float(os.getenv("LUNARY_DEBUG_RATE_LIMIT", DEFAULT_DEBUG_RATE_LIMIT))
+            self.debug_file = os.getenv("LUNARY_DEBUG_FILE") or None
+            self.spool_dir = os.getenv("LUNARY_SPOOL_DIR") or None
+            self.spool_max_bytes = int(os.getenv("LUNARY_SPOOL_MAX_BYTES", DEFAULT_SPOOL_MAX_BYTES))
+            self.spool_fsync_interval = float(os.getenv("LUNARY_SPOOL_FSYNC_INTERVAL", DEFAULT_SPOOL_FSYNC_INTERVAL))
+            self.sample_rate = float(os.getenv("LUNARY_SAMPLE_RATE", 1.0))
+            self.sampling_rules = _parse_sampling_rules(os.getenv("LUNARY_SAMPLING_RULES") or "")
+            self.sampling_cache_size = int(os.getenv("LUNARY_SAMPLING_CACHE_SIZE", DEFAULT_SAMPLING_CACHE_SIZE))
+            self.tail_sampling = os.getenv("LUNARY_TAIL_SAMPLING") is not None
+            self.tail_latency_threshold = float(os.environ["LUNARY_TAIL_LATENCY_THRESHOLD"]) if os.getenv("LUNARY_TAIL_LATENCY_THRESHOLD") else None
+            self.tail_tokens_threshold = int(os.environ["LUNARY_TAIL_TOKENS_THRESHOLD"]) if os.getenv("LUNARY_TAIL_TOKENS_THRESHOLD") else None
+            self.tail_max_events = int(os.getenv("LUNARY_TAIL_MAX_EVENTS", DEFAULT_TAIL_MAX_EVENTS))
+            self.tail_trace_timeout = float(os.getenv("LUNARY_TAIL_TRACE_TIMEOUT", DEFAULT_TAIL_TRACE_TIMEOUT))
+            self.stream_progress_interval = float(os.environ["LUNARY_STREAM_PROGRESS_INTERVAL"]) if os.getenv("LUNARY_STREAM_PROGRESS_INTERVAL") else None
+            self.stream_passthrough = _check_stream_passthrough(os.getenv("LUNARY_STREAM_PASSTHROUGH") or None)
             self.initialized = True
       
     def __repr__(self):
         return (f"Config(app_id={self.app_id!r}, verbose={self.verbose!r}, "
                 f"api_url={self.api_url!r}, ssl_verify={self.ssl_verify!r})")
 
+def _check_queue_policy(policy: str) -> str:
+    if policy not in QUEUE_POLICIES:
+        raise ValueError(f"Invalid queue policy {policy!r}, expected one of {', '.join(QUEUE_POLICIES)}")
+    return policy
+
+def _check_compression(compression: str | None) -> str | None:
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Invalid compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+    return compression
+
+def _check_stream_passthrough(mode: str | None) -> str | None:
+    if mode is not None and mode not in STREAM_PASSTHROUGH_MODES:
+        raise ValueError(f"Invalid stream pass-through mode {mode!r}, expected one of {', '.join(STREAM_PASSTHROUGH_MODES)}")
+    return mode
+
+def _parse_sampling_rules(rules: str) -> dict[str, float]:
+    """Parses `type:llm=0.1,tag:beta=1` into `{"type:llm": 0.1, "tag:beta": 1.0}`."""
+    parsed = {}
+    for rule in filter(None, (rule.strip() for rule in rules.split(","))):
+        key, _, rate = rule.rpartition("=")
+        parsed[key.strip()] = float(rate)
+    return _check_sampling_rules(parsed)
+
+def _check_sampling_rules(rules: dict[str, float]) -> dict[str, float]:
+    for key in rules:
+        if key.partition(":")[0] not in SAMPLING_RULE_KINDS:
+            raise ValueError(f"Invalid sampling rule {key!r}, expected one of {', '.join(k + ':...' for k in SAMPLING_RULE_KINDS)}")
+    return rules
+
 config = Config()
 
 def get_config() -> Config:
     return config
 
-def set_config(app_id: str | None = None, verbose: bool | None = None, api_url: str | None = None, disable_ssl_verify: bool = False) -> None:
+def set_config(app_id: str | None = None, verbose: bool | None = None, api_url: str | None = None, disable_ssl_verify: bool = False,
+               http_pool_size: int | None = None, http_timeout: float | None = None,
+               max_queue_size: int | None = None, max_queue_bytes: int | None = None, queue_policy: str | None = None,
+               queue_block_timeout: float | None = None, spill_dir: str | None = None, spill_max_bytes: int | None = None,
+               max_batch_size: int | None = None, max_batch_bytes: int | None = None,
+               retry_base_delay: float | None = None, retry_max_delay: float | None = None, breaker_threshold: int | None = None,
+               compression: str | None = None, compression_min_bytes: int | None = None,
+               serializer: str | Serializer | None = None, serialize_on_enqueue: bool | None = None,
+               flush_at: int | None = None, flush_bytes: int | None = None, flush_interval: float | None = None,
+               spool_dir: str | None = None, spool_max_bytes: int | None = None, spool_fsync_interval: float | None = None,
+               sender_workers: int | None = None, debug_sample_rate: float | None = None,
+               debug_rate_limit: float | None = None, debug_file: str | None = None,
+               sample_rate: float | None = None, sampling_rules: dict[str, float] | None = None,
+               sampling_cache_size: int | None = None,
+               tail_sampling: bool | None = None, tail_latency_threshold: float | None = None,
+               tail_tokens_threshold: int | None = None, tail_max_events: int | None = None,
+               tail_trace_timeout: float | None = None, stream_progress_interval: float | None = None,
+               stream_passthrough: str | None = None) -> None:
     config.app_id = app_id or config.app_id
     config.verbose = verbose if verbose is not None else config.verbose
     config.api_url = api_url or config.api_url
     config.ssl_verify = not disable_ssl_verify
-
+    config.http_pool_size = http_pool_size or config.http_pool_size
+    config.http_timeout = http_timeout or config.http_timeout
+    config.max_queue_size = max_queue_size or config.max_queue_size
+    config.max_queue_bytes = max_queue_bytes or config.max_queue_bytes
+    config.queue_policy = _check_queue_policy(queue_policy) if queue_policy else config.queue_policy
+    config.queue_block_timeout = queue_block_timeout if queue_block_timeout is not None else config.queue_block_timeout
+    config.spill_dir = spill_dir or config.spill_dir
+    config.spill_max_bytes = spill_max_bytes or config.spill_max_bytes
+    config.max_batch_size = max_batch_size or config.max_batch_size
+    config.max_batch_bytes = max_batch_bytes or config.max_batch_bytes
+    config.retry_base_delay = retry_base_delay if retry_base_delay is not None else config.retry_base_delay
+    config.retry_max_delay = retry_max_delay or config.retry_max_delay
+    config.breaker_threshold = breaker_threshold or config.breaker_threshold
+    config.compression = _check_compression(compression) if compression else config.compression
+    config.compression_min_bytes = compression_min_bytes if compression_min_bytes is not None else config.compression_min_bytes
+    if serializer is not None:
+        config.serializer = serializer if isinstance(serializer, Serializer) else create_serializer(serializer)
+    config.serialize_on_enqueue = serialize_on_enqueue if serialize_on_enqueue is not None else config.serialize_on_enqueue
+    config.flush_at = flush_at or config.flush_at
+    config.flush_bytes = flush_bytes or config.flush_bytes
+    config.flush_interval = flush_interval if flush_interval is not None else config.flush_interval
+    config.spool_dir = spool_dir or config.spool_dir
+    config.sender_workers = sender_workers or config.sender_workers
+    config.debug_sample_rate = debug_sample_rate if debug_sample_rate is not None else config.debug_sample_rate
+    config.debug_rate_limit = debug_rate_limit or config.debug_rate_limit
+    config.debug_file = debug_file or config.debug_file
+    config.spool_max_bytes = spool_max_bytes or config.spool_max_bytes
+    config.spool_fsync_interval = spool_fsync_interval if spool_fsync_interval is not None else config.spool_fsync_interval
+    config.sample_rate = sample_rate if sample_rate is not None else config.sample_rate
+    config.sampling_rules = _check_sampling_rules(sampling_rules) if sampling_rules is not None else config.sampling_rules
+    config.sampling_cache_size = sampling_cache_size or config.sampling_cache_size
+    config.tail_sampling = tail_sampling if tail_sampling is not None else config.tail_sampling
+    config.tail_latency_threshold = tail_latency_threshold if tail_latency_threshold is not None else config.tail_latency_threshold
+    config.tail_tokens_threshold = tail_tokens_threshold if tail_tokens_threshold is not None else config.tail_tokens_threshold
+    config.tail_max_events = tail_max_events or config.tail_max_events
+    config.tail_trace_timeout = tail_trace_timeout or config.tail_trace_timeout
+    config.stream_progress_interval = stream_progress_interval if stream_progress_interval is not None else config.stream_progress_interval
+    config.stream_passthrough = _check_stream_passthrough(stream_passthrough) if stream_passthrough else config.stream_passthrough
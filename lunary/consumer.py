@@ -1,73 +1,406 @@
 import time
 import atexit
-import requests
+import itertools
 import os
 import logging
-from threading import Thread
-import jsonpickle
+from threading import Thread, Lock, Event
+from concurrent.futures import ThreadPoolExecutor
 from .config import get_config
+from .session import get_session
+from .backoff import CircuitBreaker, parse_retry_after
+from .compression import compress, resolve_compression
+from .events import encode_event, event_route, event_run_id
 
 logger = logging.getLogger(__name__)
 
-class Consumer(Thread):
+# Statuses meaning that the payload itself was rejected: retrying it as is will never succeed
+POISONED_STATUSES = (400, 413, 422)
+# Statuses a server that does not understand the Content-Encoding may answer with
+COMPRESSION_REJECTED_STATUSES = (400, 415)
+
+
+class BaseConsumer:
+    """
+    Batching, routing and retry logic shared by the Consumer thread and the AsyncConsumer,
+    which only differ in how they wait and send requests.
+    """
+
     def __init__(self, event_queue, app_id=None):
         self.running = True
         self.event_queue = event_queue
         self.app_id = app_id
+        self.breakers = {}
+        self.uncompressed_urls = set()
+        self.backing_off = False
+
+    def group_batch(self, batch, config) -> dict:
+        """Groups the events by the (token, api_url) pair they must be sent with."""
+        groups = {}
+        for event in batch:
+            app_id, api_url = event_route(event)
+            route = (app_id or self.app_id or config.app_id, api_url or config.api_url)
+            groups.setdefault(route, []).append(event)
+        return groups
+
+    def check_route(self, route, events, config) -> CircuitBreaker | None:
+        """Returns the breaker of the route, or None after dropping the events if it has no API key."""
+        if not route[0]:
+            logger.error("API key not found. Please provide an API key.")
+            self.event_queue.record_dropped(len(events))
+            return None
+        return self.get_breaker(route, config)
+
+    def get_breaker(self, route, config) -> CircuitBreaker:
+        breaker = self.breakers.get(route)
+        if breaker is None:
+            breaker = self.breakers.setdefault(route, CircuitBreaker(
+                failure_threshold=config.breaker_threshold,
+                base_delay=config.retry_base_delay,
+                max_delay=config.retry_max_delay,
+            ))
+        return breaker
+
+    def take_batch(self, from_disk: bool = True) -> list:
+        """
+        Takes the next batch from the queue. The spool and the spill file are not read
+        while a route backs off: their events are read in order, so they would only be
+        put back.
+        """
+        backing_off = not all(breaker.ready() for breaker in list(self.breakers.values()))
+        batch = self.event_queue.get_batch(from_disk and not backing_off)
+        if backing_off and not batch:
+            self.backing_off = True
+        return batch
+
+    def chunk_batch(self, batch, config):
+        """
+        Encodes the events that are not yet and groups them into chunks of at most
+        `config.max_batch_size` events and `config.max_batch_bytes` bytes.
+        Yields lists of EncodedEvent.
+        """
+        chunk, chunk_bytes = [], 0
+        for event in batch:
+            try:
+                encoded = encode_event(event, config.serializer)
+            except Exception as e:
+                logger.error(f"Could not serialize event, dropping it: {e}")
+                self.event_queue.record_dropped(1)
+                continue
+
+            size = len(encoded)
+            if size > config.max_batch_bytes:
+                logger.error(f"Event of {size} bytes exceeds the maximum batch size, dropping it.")
+                self.event_queue.record_dropped(1)
+                continue
+
+            if chunk and (len(chunk) >= config.max_batch_size or chunk_bytes + size > config.max_batch_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+
+            chunk.append(encoded)
+            chunk_bytes += size
+
+        if chunk:
+            yield chunk
+
+    def make_payload(self, chunk, api_url, config) -> tuple[bytes, str | None]:
+        """Returns the body of the ingest request and the compression to send it with."""
+        data = b'{"events":[' + b",".join(event.data for event in chunk) + b']}'
+        encoding = None
+        if config.compression and api_url not in self.uncompressed_urls and len(data) >= config.compression_min_bytes:
+            encoding = resolve_compression(config.compression)
+        return data, encoding
+
+    def disable_compression(self, api_url, encoding) -> None:
+        logger.warning(f"{api_url} does not accept {encoding} compressed payloads, sending them uncompressed")
+        self.uncompressed_urls.add(api_url)
+
+    def handle_response(self, chunk, status: int, headers, text: str, breaker, config) -> list | None:
+        """
+        Records the outcome of sending a chunk. Returns the events that should be retried,
+        or None when the API rejected the chunk and it must be split to isolate the
+        offending events.
+        """
+        if status < 400:
+            breaker.record_success()
+            self.event_queue.record_sent(len(chunk))
+            if config.verbose:
+                logger.info(f"{len(chunk)} events sent ({status}).")
+            return []
+
+        if status not in POISONED_STATUSES:
+            breaker.record_failure(parse_retry_after(headers.get("Retry-After")))
+            logger.error(f"Error sending events: {status}")
+            return chunk
+
+        breaker.record_success()
+
+        if len(chunk) == 1:
+            logger.error(f"Event rejected by the API, dropping it: {status} - {text}")
+            self.event_queue.record_dropped(1)
+            return []
+        return None
+
+    def log_send_error(self, e: Exception, config) -> None:
+        if config.verbose:
+            logger.exception(f"Error sending events: {e}")
+        else:
+            logger.error(f"Error sending events")
+
+    def finish_batch(self, failed: list) -> None:
+        self.backing_off = bool(failed)
+        if failed:
+            self.event_queue.requeue(failed)
+        self.event_queue.commit()
+
+
+class Consumer(BaseConsumer, Thread):
+    def __init__(self, event_queue, app_id=None):
+        BaseConsumer.__init__(self, event_queue, app_id)
+        self.executor = None
+        self.sending = Lock()
+        self.stopped = Event()
+        # Number of events being sent by the sender workers, per (route, task number) and
+        # per (route, run id), see `dispatch_batch`
+        self.in_flight = {}
+        self.runs_in_flight = {}
+        self.tasks = itertools.count()
+        self.routes_lock = Lock()
+        self.route_done = Event()
 
         Thread.__init__(self, daemon=True)
         atexit.register(self.stop)
 
     def run(self):
         while self.running:
-            self.send_batch()
-            time.sleep(0.5)
+            self.event_queue.wait_for_batch()
+            if not self.running:
+                break
+            self.send_batch(wait=False)
+            if self.backing_off:
+                # The events were requeued: do not spin on them until the API recovers
+                self.stopped.wait(get_config().flush_interval)
 
         self.send_batch()
 
-    def send_batch(self):
-        config = get_config()
-        batch = self.event_queue.get_batch()
+    def send_batch(self, timeout: float = -1, wait: bool = True):
+        """
+        Sends the queued events. Only one batch is in flight at a time: when called
+        from another thread (e.g. by `flush`), waits up to `timeout` seconds for the
+        batch being sent by the consumer thread.
 
-        verbose = config.verbose
-        api_url = config.api_url
+        With a single sender worker, the batch is sent from the calling thread. With
+        several, it is handed over to the workers and, unless `wait` is False, this
+        waits for them to be done. Once stopped, e.g. at exit when the workers cannot
+        be given new tasks anymore, it is sent from the calling thread as well.
+        """
+        start = time.monotonic()
+        if not self.sending.acquire(timeout=timeout):
+            return
+        try:
+            config = get_config()
+            if config.sender_workers > 1 and self.running:
+                self.dispatch_batch(config, None if timeout < 0 else timeout)
+            else:
+                # Routes still being sent by the workers go first, to keep their order
+                self.wait_for_workers(None if timeout < 0 else timeout)
+                self._send_batch()
+        finally:
+            self.sending.release()
 
+        if wait and self.in_flight:
+            self.wait_for_workers(None if timeout < 0 else max(0, timeout - (time.monotonic() - start)))
+
+    def _send_batch(self):
+        config = get_config()
+        batch = self.take_batch()
 
         if len(batch) > 0:
-            token = batch[0].get("appId") or self.app_id or config.app_id
-            if not token:
-                return logger.error("API key not found. Please provide an API key.")
+            failed = []
+            for route, events in self.group_batch(batch, config).items():
+                failed += self.send_group(route, events, config)
+            self.finish_batch(failed)
+
+    def dispatch_batch(self, config, timeout: float | None = None) -> None:
+        """
+        Hands the queued events over to the sender workers without waiting for them to be
+        sent, so the next batch can be prepared meanwhile. The events of a route are split
+        by run into up to `sender_workers` tasks of about `max_batch_size` events, so a
+        single project gets several requests in flight when it has the events for them.
 
-            if verbose:
-                logging.info(f"Sending {len(batch)} events.")
+        The events of a run are sent in order: those of a run that is still being sent
+        are put back at the front of the queue, where the events of that run that fail
+        are requeued before them. The spool and the spill file are only read while
+        nothing is in flight: the events held back would rewind them, and the events
+        read with them would be sent twice.
+        """
+        inline = []
+        busy = []
+        with self.routes_lock:
+            self.route_done.clear()
+            batch = self.take_batch(from_disk=not self.in_flight)
+            executor = self.get_executor(config) if batch else None
+            for route, events in self.group_batch(batch, config).items():
+                ready = []
+                for event in events:
+                    (busy if (route, event_run_id(event)) in self.runs_in_flight else ready).append(event)
+                for task_events in self.split_runs(ready, config):
+                    task = (route, next(self.tasks))
+                    self.in_flight[task] = len(task_events)
+                    for event in task_events:
+                        run = (route, event_run_id(event))
+                        self.runs_in_flight[run] = self.runs_in_flight.get(run, 0) + 1
+                    try:
+                        executor.submit(self.send_route, task, task_events, config)
+                    except RuntimeError:
+                        # The interpreter is shutting down: no new tasks for the workers
+                        inline.append((task, task_events))
+            if busy:
+                self.event_queue.requeue(busy)
+
+        for task, events in inline:
+            self.send_route(task, events, config)
+
+        if busy or (not batch and self.in_flight):
+            # Wait for a worker to be done rather than spin on the requeued events
+            self.route_done.wait(config.flush_interval if timeout is None else min(timeout, config.flush_interval))
+
+    @staticmethod
+    def split_runs(events, config) -> list[list]:
+        """
+        Splits the events of a route into tasks of about `max_batch_size` events, at most
+        `sender_workers` of them, keeping the events of each run in the same task.
+        """
+        tasks = []
+        task_of = {}
+        for event in events:
+            run_id = event_run_id(event)
+            index = task_of.get(run_id)
+            if index is None:
+                if not tasks or (len(tasks[-1]) >= config.max_batch_size and len(tasks) < config.sender_workers):
+                    tasks.append([])
+                index = task_of[run_id] = len(tasks) - 1
+            tasks[index].append(event)
+        return tasks
+
+    def send_route(self, task, events, config) -> None:
+        """Runs in a sender worker: sends the events of a task and requeues the failed ones."""
+        try:
+            failed = self.send_group(task[0], events, config)
+        except Exception as e:
+            self.log_send_error(e, config)
+            failed = events
+
+        with self.routes_lock:
+            self.backing_off = bool(failed)
+            if failed:
+                self.event_queue.requeue(failed)
+            del self.in_flight[task]
+            for event in events:
+                run = (task[0], event_run_id(event))
+                if self.runs_in_flight[run] > 1:
+                    self.runs_in_flight[run] -= 1
+                else:
+                    del self.runs_in_flight[run]
+            # Under the lock: batches are read under it too, so once nothing is in
+            # flight, every event read from the spool so far has been sent or requeued
+            if not self.in_flight:
+                self.event_queue.commit()
+        self.route_done.set()
 
+    @property
+    def pending(self) -> int:
+        """Number of events taken from the queue that the sender workers are still sending."""
+        with self.routes_lock:
+            return sum(self.in_flight.values())
+
+    def wait_for_workers(self, timeout: float | None) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.in_flight:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            self.route_done.wait(0.05 if remaining is None else min(remaining, 0.05))
+            self.route_done.clear()
+
+    def get_executor(self, config) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=config.sender_workers, thread_name_prefix="lunary-sender")
+        return self.executor
+
+    def send_group(self, route, events, config) -> list:
+        """Sends the events of one project, returns the ones that should be retried."""
+        token, api_url = route
+        breaker = self.check_route(route, events, config)
+        if breaker is None:
+            return []
+        if not breaker.ready():
+            # Backing off: keep the events buffered until the next attempt is due
+            return events
+
+        if config.verbose:
+            logger.info(f"Sending {len(events)} events to {api_url}.")
+
+        failed = []
+        chunks = self.chunk_batch(events, config)
+        for chunk in chunks:
+            if not breaker.acquire():
+                failed += [event for rest in [chunk, *chunks] for event in rest]
+                break
             try:
-                if verbose:
-                    logging.info("Sending events to ", api_url)
-
-                headers = {
-                    'Authorization': f'Bearer {token}',
-                    'Content-Type': 'application/json'
-                }
-            
-                data = jsonpickle.encode({"events": batch}, unpicklable=False)
-                response = requests.post(
-                    api_url + "/v1/runs/ingest",
-                    data=data,
-                    headers=headers,
-                    verify=config.ssl_verify)
-                response.raise_for_status()
-
-                if verbose:
-                    logging.info("Events sent.", response.status_code)
+                failed += self.send_chunk(chunk, token, api_url, breaker, config)
             except Exception as e:
-                if verbose:
-                    logging.exception(f"Error sending events: {e}")
-                else:
-                    logging.error(f"Error sending events")
+                breaker.record_failure()
+                self.log_send_error(e, config)
+                failed += [event for rest in [chunk, *chunks] for event in rest]
+                break
+        return failed
+
+    def send_chunk(self, chunk, token, api_url, breaker, config) -> list:
+        """
+        Sends a chunk of encoded events and returns the events that should be retried.
+        Chunks rejected by the API are split in two until the offending events are
+        isolated and dropped, so they do not hold back the rest of the backlog.
+        Raises if the API cannot be reached.
+        """
+        data, encoding = self.make_payload(chunk, api_url, config)
+        response = self.post(data, token, api_url, encoding, config)
+
+        if encoding and response.status_code in COMPRESSION_REJECTED_STATUSES:
+            response = self.post(data, token, api_url, None, config)
+            if response.ok:
+                self.disable_compression(api_url, encoding)
+
+        retry = self.handle_response(chunk, response.status_code, response.headers, response.text, breaker, config)
+        if retry is not None:
+            return retry
+
+        middle = len(chunk) // 2
+        return (self.send_chunk(chunk[:middle], token, api_url, breaker, config)
+                + self.send_chunk(chunk[middle:], token, api_url, breaker, config))
+
+    def post(self, data: bytes, token, api_url, encoding, config):
+        headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+        if encoding:
+            data = compress(data, encoding)
+            headers['Content-Encoding'] = encoding
 
-                self.event_queue.append(batch)
+        return get_session().post(
+            api_url + "/v1/runs/ingest",
+            data=data,
+            headers=headers,
+            verify=config.ssl_verify,
+            timeout=config.http_timeout)
 
     def stop(self):
         self.running = False
-        self.join()
+        self.stopped.set()
+        self.event_queue.wake()
+        if self.is_alive():
+            self.join()
+        self.event_queue.sync()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
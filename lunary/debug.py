@@ -0,0 +1,139 @@
+import os
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import json
+from logging.handlers import QueueListener
+from .config import get_config
+from .utils import clean_nones
+
+# Records waiting to be written, beyond which they are dropped rather than slowing the app down
+MAX_PENDING_RECORDS = 1000
+
+
+class LazyEvent:
+    """
+    An event serialized when it is logged, so later changes to the objects it holds
+    do not show, and pretty-printed only when a handler writes it.
+    """
+
+    __slots__ = ("data", "suppressed")
+
+    def __init__(self, event, serializer, suppressed: int):
+        try:
+            self.data = serializer.dumps(event.to_dict() if hasattr(event, "to_dict") else event)
+        except Exception as e:
+            self.data = e
+        self.suppressed = suppressed
+
+    def __str__(self):
+        if isinstance(self.data, Exception):
+            message = f"Could not serialize event: {self.data}"
+        else:
+            message = json.dumps(clean_nones(json.loads(self.data)), indent=4, ensure_ascii=False)
+        if self.suppressed:
+            message += f"\n({self.suppressed} events not logged, over the rate limit)"
+        return message
+
+
+class LoggerForwarder(logging.Handler):
+    """Hands the records over to a logger, from the listener thread: to its handlers and its ancestors'."""
+
+    def __init__(self, logger):
+        logging.Handler.__init__(self)
+        self.logger = logger
+
+    def emit(self, record):
+        self.logger.handle(record)
+
+
+class DebugSink:
+    """
+    Logs the tracked events when `verbose` is on, without slowing down the threads
+    tracking them: events are sampled (`debug_sample_rate`), rate-limited
+    (`debug_rate_limit` per second), then formatted and written by a background thread,
+    to `debug_file`, or through the `lunary.debug` logger, which follows the logging
+    configuration of the app.
+
+    Raising the level of the `lunary.debug` logger above INFO turns the sink off entirely.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("lunary.debug")
+        self.logger.setLevel(logging.INFO)
+        self.lock = threading.Lock()
+        self.records = None
+        self.listener = None
+        self.pid = None
+        self.target = None
+        # Starts full, capped to the rate limit on the first event
+        self.tokens = float("inf")
+        self.refilled_at = time.monotonic()
+        self.suppressed = 0
+
+    def log_event(self, event) -> None:
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        config = get_config()
+        if config.debug_sample_rate < 1 and random.random() >= config.debug_sample_rate:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            rate = config.debug_rate_limit
+            self.tokens = min(rate, self.tokens + (now - self.refilled_at) * rate)
+            self.refilled_at = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return
+            self.tokens -= 1
+            suppressed, self.suppressed = self.suppressed, 0
+
+        self.start(config)
+        record = self.logger.makeRecord(
+            self.logger.name, logging.INFO, __file__, 0, "Add event: %s",
+            (LazyEvent(event, config.serializer, suppressed),), None,
+        )
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            # The listener falls behind: drop rather than slow the app down
+            pass
+
+    def start(self, config) -> None:
+        """Starts the listener thread, again in forked children, where it does not exist."""
+        target = config.debug_file
+        if self.pid == os.getpid() and self.target == target:
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.target == target:
+                return
+            if self.pid == os.getpid():
+                self.stop()
+
+            if target:
+                output = logging.FileHandler(target, encoding="utf-8")
+                output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s:%(name)s:%(message)s"))
+            else:
+                output = LoggerForwarder(self.logger)
+            self.records = queue.Queue(MAX_PENDING_RECORDS)
+            self.listener = QueueListener(self.records, output)
+            self.listener.start()
+            self.pid = os.getpid()
+            self.target = target
+
+    def stop(self) -> None:
+        """Writes the pending records and stops the listener thread."""
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+        self.listener = None
+        self.pid = None
+
+
+debug_sink = DebugSink()
+atexit.register(debug_sink.stop)
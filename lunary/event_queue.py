@@ -1,28 +1,536 @@
+import os
+import time
+import asyncio
+import weakref
 import threading
+import logging
+from collections import deque
+from queue import SimpleQueue, Empty
+from typing import NamedTuple
 from .consumer import Consumer
+from .config import get_config, DROP_NEWEST, BLOCK, SPILL
+from .events import EncodedEvent, encode_event
+from .spill import SpillFile, SpilledEvent
+from .spool import Spool, SpooledEvent
 from contextvars import ContextVar
 
+logger = logging.getLogger(__name__)
+
+_queues = weakref.WeakSet()
+
+ENCODER_BATCH_SIZE = 1000
+FLUSH_RETRY_INTERVAL = 0.05
+
+
+class FlushResult(NamedTuple):
+    sent: int
+    dropped: int
+    pending: int
+
+
+class Encoder(threading.Thread):
+    """
+    Serializes events in the background as soon as they are tracked, so the queue
+    only holds immutable bytes instead of references to live user objects.
+    Handing an event over is a single lock-free put on the caller's thread, unless
+    the encoder falls `max_queue_size` events behind: the event is then encoded on the
+    caller's thread, which bounds the backlog.
+    """
+
+    def __init__(self, event_queue):
+        threading.Thread.__init__(self, daemon=True, name="lunary-encoder")
+        self.event_queue = event_queue
+        self.pending = SimpleQueue()
+
+    def put(self, event) -> None:
+        max_queue_size = get_config().max_queue_size
+        if max_queue_size is not None and self.pending.qsize() >= max_queue_size:
+            # The encoder is falling behind: encode on the caller's thread rather than
+            # letting the backlog of live objects grow without bound
+            return self.event_queue.add(self.event_queue.encode([event]))
+        self.pending.put(event)
+
+    def run(self):
+        while True:
+            events = [self.pending.get()]
+            while len(events) < ENCODER_BATCH_SIZE:
+                try:
+                    events.append(self.pending.get_nowait())
+                except Empty:
+                    break
+
+            barriers = [e for e in events if isinstance(e, threading.Event)]
+            if barriers:
+                events = [e for e in events if not isinstance(e, threading.Event)]
+            self.event_queue.add(self.event_queue.encode(events))
+            for barrier in barriers:
+                barrier.set()
+
+    def drain(self, timeout: float) -> bool:
+        """Waits until every event handed over so far is in the queue."""
+        barrier = threading.Event()
+        self.pending.put(barrier)
+        return barrier.wait(timeout)
+
+
 class EventQueue:
-    def __init__(self):
+    def __init__(self, start_consumer: bool = True):
+        """
+        Parameters:
+            start_consumer (bool): Start the Consumer thread sending the events in the
+                background, once the first event is queued.
+        """
+        self.start_consumer = start_consumer
+        self.reset()
+        self.open_spool()
+        _queues.add(self)
+
+    def reset(self):
+        """
+        (Re)creates the locks, buffers and threads of the queue. Called again in forked
+        children: the parent's threads do not exist there, its locks may be held forever,
+        and the queued events belong to the parent, which will send them. The child does
+        not use the parent's spool either.
+        """
         self.lock = threading.Lock()
-        self.events = []
+        self.not_full = threading.Condition(self.lock)
+        self.batch_ready = threading.Condition(self.lock)
+        self.first_event_at: float | None = None
+        # Appending to and popping from a deque is thread-safe, the lock only guards the
+        # bookkeeping (bounds, byte counts, spill file, notifications)
+        self.events = deque()
+        self.size_bytes = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.sent = 0
+        self.spill: SpillFile | None = None
+        self.spool: Spool | None = None
+        self.encoder: Encoder | None = None
+        self.encoder_lock = threading.Lock()
         self.consumer = Consumer(self)
-        self.consumer.start()
+        self.consumer_lock = threading.Lock()
+        # Set while an AsyncConsumer sends the events instead of the Consumer thread
+        self.async_consumer = None
+        self.waker = None
+
+    def start_consumer_once(self):
+        with self.consumer_lock:
+            if self.consumer.ident is None:
+                self.consumer.start()
+
+    def __len__(self):
+        return (
+            len(self.events)
+            + (self.spill.pending if self.spill else 0)
+            + (self.spool.pending if self.spool else 0)
+        )
+
+    def open_spool(self) -> None:
+        """
+        Opens the write-ahead spool configured with `spool_dir`, and starts sending the
+        events a previous run of the process left in it.
+        """
+        config = get_config()
+        with self.lock:
+            if config.spool_dir is None or (self.spool is not None and self.spool.directory == config.spool_dir):
+                return
+            try:
+                spool = Spool(config.spool_dir, config.spool_max_bytes, config.spool_fsync_interval)
+            except OSError as e:
+                logger.error(f"Could not open the spool in {config.spool_dir}, events will only be kept in memory: {e}")
+                return
+            if self.spool is not None:
+                self.spool.close()
+            self.spool = spool
+            self._notify_consumer(True, config)
+
+        if self.start_consumer and spool.pending:
+            self.start_consumer_once()
 
     def append(self, event):
+        events = event if isinstance(event, list) else [event]
+        if get_config().serialize_on_enqueue:
+            encoder = self.get_encoder()
+            for e in events:
+                encoder.put(e)
+        else:
+            self.add(events)
+
+    def offer(self, event) -> bool:
+        """
+        Appends an event only if the queue has room, without blocking or evicting other
+        events: for events worth less than the others, like streaming progress.
+        Returns False if the event was left out.
+        """
+        if self._is_full(0, get_config()):
+            return False
+        self.append(event)
+        return True
+
+    def add(self, events: list):
+        config = get_config()
+        if config.max_queue_bytes is not None:
+            # The size is only known once encoded, keep the encoded version
+            events = self.encode(events)
+        if self.spool is not None:
+            self._add_to_spool(events, config)
+        else:
+            self._add_to_memory(events, config)
+
+        if self.start_consumer and self.consumer.ident is None:
+            self.start_consumer_once()
+
+    def _add_to_memory(self, events: list, config) -> None:
+        sizes = [self._size(e) for e in events]
+        if not self._add_unlocked(events, sizes, config):
+            with self.lock:
+                was_empty = not self.events
+                for e, size in zip(events, sizes):
+                    if self._make_room(size, config):
+                        self.events.append(e)
+                        self.size_bytes += size
+                    else:
+                        self.dropped += 1
+                self._notify_consumer(was_empty, config)
+
+    def _add_to_spool(self, events: list, config) -> None:
+        events = self.encode(events)
         with self.lock:
-            if isinstance(event, list):
-                self.events.extend(event)
-            else:
-                self.events.append(event)
+            was_empty = not len(self)
+            try:
+                written = self.spool.append(events)
+                self.dropped += len(events) - written
+            except OSError as e:
+                logger.error(f"Could not write events to the spool, keeping them in memory: {e}")
+                for event in events:
+                    self.events.append(event)
+                    self.size_bytes += self._size(event)
+            self._notify_consumer(was_empty, config)
+
+    def _add_unlocked(self, events: list, sizes: list, config) -> bool:
+        """
+        Fast path taken by most `track_event` calls: appends without taking the lock when
+        the events have no byte size to account for and the queue has room. The lock is
+        only taken to wake the consumer. With many threads appending at once, the queue
+        may briefly exceed `max_queue_size` by a few events.
+        Returns False when the events must go through the locked path instead.
+        """
+        if any(sizes):
+            return False
+        before = len(self.events)
+        if config.max_queue_size is not None and before + len(events) > config.max_queue_size:
+            return False
+
+        self.events.extend(events)
+        after = len(self.events)
+        # Also when the consumer drained the queue since `before` was read: its timer
+        # is not running then, and it would wait for the next batch without a timeout
+        if before == 0 or self.first_event_at is None or before < config.flush_at <= after:
+            with self.lock:
+                self._notify_consumer(self.first_event_at is None, config)
+        return True
 
-    def get_batch(self):
-        if self.lock.acquire(False): # non-blocking
+    def encode(self, events) -> list[EncodedEvent]:
+        serializer = get_config().serializer
+        encoded = []
+        for event in events:
             try:
-                events = self.events
-                self.events = []
-                return events
-            finally:
-                self.lock.release()
-        else:
+                encoded.append(encode_event(event, serializer))
+            except Exception as e:
+                logger.error(f"Could not serialize event, dropping it: {e}")
+                self.record_dropped(1)
+        return encoded
+
+    def get_encoder(self) -> Encoder:
+        if self.encoder is None:
+            with self.encoder_lock:
+                if self.encoder is None:
+                    encoder = Encoder(self)
+                    encoder.start()
+                    self.encoder = encoder
+        return self.encoder
+
+    def requeue(self, events):
+        """
+        Puts events that could not be sent back at the front of the queue, so they keep
+        their order. Never blocks: if the queue overflows, the oldest events are evicted.
+        Events read from the spool or the spill file are left there instead: they are
+        rewound to them, so they are neither held in memory nor written twice.
+        """
+        config = get_config()
+        spooled = [e for e in events if isinstance(e, SpooledEvent)] if self.spool is not None else []
+        spilled = [e for e in events if isinstance(e, SpilledEvent)] if self.spill is not None else []
+        if spooled or spilled:
+            events = [e for e in events if not isinstance(e, (SpooledEvent, SpilledEvent))]
+            with self.lock:
+                if spooled:
+                    self.spool.rewind(spooled)
+                if spilled:
+                    self.spill.rewind(spilled)
+                if self.first_event_at is None:
+                    self.first_event_at = time.monotonic()
+            if not events:
+                return
+        if config.max_queue_bytes is not None:
+            events = self.encode(events)
+        sizes = [self._size(e) for e in events]
+
+        with self.lock:
+            if self.first_event_at is None:
+                self.first_event_at = time.monotonic()
+            self.events.extendleft(reversed(events))
+            self.size_bytes += sum(sizes)
+            evicted = []
+            while len(self.events) > 1 and (
+                (config.max_queue_size is not None and len(self.events) > config.max_queue_size)
+                or (config.max_queue_bytes is not None and self.size_bytes > config.max_queue_bytes)
+            ):
+                evicted.append(self._pop_oldest())
+            self._evict(evicted, config)
+
+    def get_batch(self, from_disk: bool = True):
+        """
+        Takes the queued events. The spill file and the spool are only read when
+        `from_disk` is True: consumers pass False while they back off, so the events on
+        disk stay there until they can be sent. The spool is not read either while failed
+        events wait in memory.
+        """
+        with self.lock:
+            # Pop rather than copy and clear: events appended concurrently without the
+            # lock are either part of this batch or left for the next one, never lost
+            popleft = self.events.popleft
+            events = [popleft() for _ in range(len(self.events))]
+            self.size_bytes -= sum(self._size(e) for e in events)
+            self.first_event_at = time.monotonic() if self.events else None
+            if self.spill and self.spill.pending and from_disk:
+                events = self._read_spill() + events
+            if self.spool is not None and from_disk and not events:
+                events = self._read_spool()
+            self.not_full.notify_all()
+            return events
+
+    def commit(self) -> None:
+        """
+        Called once the events of the last batch were sent or dropped for good, marks
+        them as delivered in the spool. Nothing is committed while failed events wait in
+        memory for a retry, so they are sent again if the process dies in the meantime.
+        Deletes the spill file once every event spilled was sent.
+        """
+        with self.lock:
+            if self.spill is not None and self.spill.size and not self.spill.pending:
+                self.spill.clear()
+            if self.spool is not None and not self.events:
+                try:
+                    self.spool.commit()
+                except OSError as e:
+                    logger.error(f"Could not commit the spool: {e}")
+
+    def sync(self) -> None:
+        """Forces the spooled events to disk."""
+        with self.lock:
+            if self.spool is not None:
+                try:
+                    self.spool.sync()
+                except OSError as e:
+                    logger.error(f"Could not sync the spool: {e}")
+
+    def wait_for_batch(self) -> None:
+        """
+        Blocks the consumer until a batch is worth sending: `flush_at` events or
+        `flush_bytes` bytes are queued, or the oldest queued event has waited
+        `flush_interval` seconds. Sleeps without a timeout while the queue is empty.
+        """
+        config = get_config()
+        with self.lock:
+            while self.consumer.running:
+                delay = self.flush_delay(config)
+                if delay is not None and delay <= 0:
+                    return
+                self.batch_ready.wait(delay)
+
+    def flush_delay(self, config) -> float | None:
+        """Seconds until the next batch is due: 0 if it is now, None while the queue is empty."""
+        if len(self) >= config.flush_at or self.size_bytes >= config.flush_bytes:
+            return 0
+        if self.first_event_at is None:
+            if not len(self):
+                return None
+            # Only spilled events are left, or events were appended while draining
+            self.first_event_at = time.monotonic()
+        return self.first_event_at + config.flush_interval - time.monotonic()
+
+    async def drain(self, timeout: float) -> FlushResult:
+        """
+        Awaitable version of `flush`. Sends the events from the AsyncConsumer when one
+        runs on the current event loop, from a worker thread otherwise.
+        """
+        consumer = self.async_consumer
+        if consumer is not None and consumer.loop is asyncio.get_running_loop():
+            return await consumer.flush(timeout)
+        return await asyncio.to_thread(self.flush, timeout)
+
+    def wake(self) -> None:
+        """Wakes the consumer up, e.g. so it notices it was stopped."""
+        with self.lock:
+            self.batch_ready.notify_all()
+            if self.waker is not None:
+                self.waker()
+
+    def record_dropped(self, count: int) -> None:
+        with self.lock:
+            self.dropped += count
+
+    def record_sent(self, count: int) -> None:
+        with self.lock:
+            self.sent += count
+
+    def flush(self, timeout: float) -> FlushResult:
+        """
+        Sends the queued events from the calling thread, whether or not the consumer
+        thread is running. Returns once the queue is empty or after `timeout` seconds
+        (plus at most one in-flight HTTP request).
+
+        While an AsyncConsumer runs, the events are sent by it, on its event loop: two
+        consumers sending at once could commit the spool past events the other one has
+        not sent yet. From that loop, use `drain` instead.
+        """
+        consumer = self.async_consumer
+        if consumer is not None:
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is consumer.loop:
+                raise RuntimeError("Cannot flush synchronously from the AsyncConsumer's event loop, use `await lunary.aflush()`")
+            return asyncio.run_coroutine_threadsafe(consumer.flush(timeout), consumer.loop).result()
+
+        deadline = time.monotonic() + timeout
+        sent, dropped = self.sent, self.dropped
+
+        if self.encoder is not None:
+            self.encoder.drain(max(0, deadline - time.monotonic()))
+
+        while True:
+            before = self.sent
+            # Also waits for the batch the consumer thread may be sending
+            self.consumer.send_batch(timeout=max(0, deadline - time.monotonic()))
+            if len(self) == 0 or time.monotonic() >= deadline:
+                break
+            if self.sent == before:
+                # Nothing went out, the API is probably backing us off
+                time.sleep(max(0, min(FLUSH_RETRY_INTERVAL, deadline - time.monotonic())))
+
+        return FlushResult(sent=self.sent - sent, dropped=self.dropped - dropped, pending=len(self) + self.consumer.pending)
+
+    def stats(self) -> dict:
+        """Counters describing the queue, meant to be exported to a metrics system."""
+        with self.lock:
+            return {
+                "queued": len(self.events),
+                "queued_bytes": self.size_bytes,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "spill_pending": self.spill.pending if self.spill else 0,
+                "spooled": self.spool.pending if self.spool else 0,
+                "spool_dropped": self.spool.dropped if self.spool else 0,
+            }
+
+    @staticmethod
+    def _size(event) -> int:
+        # The size of events that are not encoded yet is unknown, they only count against `flush_at`
+        if isinstance(event, EncodedEvent):
+            return len(event)
+        return 0
+
+    def _notify_consumer(self, was_empty: bool, config) -> None:
+        """Wakes the consumer when the first event arrives (to start its timer) or a batch is full."""
+        if was_empty and len(self):
+            if self.first_event_at is None:
+                self.first_event_at = time.monotonic()
+        elif len(self.events) < config.flush_at and self.size_bytes < config.flush_bytes:
+            return
+        self.batch_ready.notify()
+        if self.waker is not None:
+            self.waker()
+
+    def _is_full(self, size: int, config) -> bool:
+        if config.max_queue_size is not None and len(self.events) >= config.max_queue_size:
+            return True
+        if config.max_queue_bytes is not None and self.events and self.size_bytes + size > config.max_queue_bytes:
+            return True
+        return False
+
+    def _make_room(self, size: int, config) -> bool:
+        """Applies the queue policy. Returns False if the incoming event must be dropped."""
+        if not self._is_full(size, config):
+            return True
+
+        policy = config.queue_policy
+        if policy == DROP_NEWEST:
+            return False
+
+        if policy == BLOCK:
+            deadline = time.monotonic() + config.queue_block_timeout
+            while self._is_full(size, config):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.not_full.wait(remaining)
+            return True
+
+        evicted = []
+        while self._is_full(size, config) and self.events:
+            evicted.append(self._pop_oldest())
+        self._evict(evicted, config)
+        return True
+
+    def _pop_oldest(self):
+        event = self.events.popleft()
+        self.size_bytes -= self._size(event)
+        return event
+
+    def _evict(self, events: list, config) -> None:
+        if not events:
+            return
+
+        if config.queue_policy == SPILL:
+            try:
+                if self.spill is None or (self.spill.directory != config.spill_dir and not self.spill.pending):
+                    self.spill = SpillFile(config.spill_dir, config.spill_max_bytes)
+                written = self.spill.write(events)
+                self.spilled += written
+                self.dropped += len(events) - written
+                return
+            except OSError as e:
+                logger.error(f"Could not spill events to disk: {e}")
+
+        self.dropped += len(events)
+
+    def _read_spool(self) -> list:
+        try:
+            # Syncs at least once per batch, even when nothing new is tracked
+            self.spool.sync()
+            return self.spool.read(get_config().max_queue_size or self.spool.pending)
+        except OSError as e:
+            logger.error(f"Could not read the spool: {e}")
+            return []
+
+    def _read_spill(self) -> list:
+        config = get_config()
+        try:
+            return self.spill.read(config.max_queue_size or self.spill.pending)
+        except Exception as e:
+            logger.error(f"Could not read spilled events: {e}")
+            self.dropped += self.spill.pending
+            self.spill.clear()
             return []
+
+
+def _reset_queues_after_fork():
+    for queue in list(_queues):
+        queue.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_queues_after_fork)
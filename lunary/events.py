@@ -0,0 +1,148 @@
+class EncodedEvent:
+    """
+    An event already serialized to the JSON sent to the API, along with the
+    project and API URL the consumer needs to route it, and the run it belongs to.
+    """
+
+    __slots__ = ("data", "app_id", "api_url", "run_id")
+
+    def __init__(self, data: bytes, app_id: str | None = None, api_url: str | None = None, run_id: str | None = None):
+        self.data = data
+        self.app_id = app_id
+        self.api_url = api_url
+        self.run_id = run_id
+
+    def __len__(self):
+        return len(self.data)
+
+
+# Fields of an Event and the keys they are sent as, in the order they are sent
+WIRE_FIELDS = (
+    ("event", "event"),
+    ("type", "type"),
+    ("name", "name"),
+    ("user_id", "userId"),
+    ("user_props", "userProps"),
+    ("tags", "tags"),
+    ("thread_tags", "threadTags"),
+    ("run_id", "runId"),
+    ("parent_run_id", "parentRunId"),
+    ("timestamp", "timestamp"),
+    ("message", "message"),
+    ("input", "input"),
+    ("output", "output"),
+    ("error", "error"),
+    ("feedback", "feedback"),
+    ("runtime", "runtime"),
+    ("token_usage", "tokensUsage"),
+    ("metadata", "metadata"),
+    ("params", "params"),
+    ("template_id", "templateId"),
+    ("app_id", "appId"),
+)
+_SLOTS_BY_KEY = {key: slot for slot, key in WIRE_FIELDS} | {"apiUrl": "api_url"}
+
+
+class Event:
+    """
+    An event tracked by `track_event`, waiting in the queue to be serialized.
+
+    Reads like the dict it is sent as (`event["runId"]`, `event.get("appId")`), but
+    holds its fields in slots: less than half the memory of a 21 keys dict.
+    """
+
+    __slots__ = tuple(slot for slot, _ in WIRE_FIELDS) + ("api_url",)
+
+    def __init__(self, event=None, type=None, name=None, user_id=None, user_props=None, tags=None,
+                 thread_tags=None, run_id=None, parent_run_id=None, timestamp=None, message=None,
+                 input=None, output=None, error=None, feedback=None, runtime=None, token_usage=None,
+                 metadata=None, params=None, template_id=None, app_id=None, api_url=None):
+        # Assigned one by one rather than in a loop, `track_event` is a hot path
+        self.event = event
+        self.type = type
+        self.name = name
+        self.user_id = user_id
+        self.user_props = user_props
+        self.tags = tags
+        self.thread_tags = thread_tags
+        self.run_id = run_id
+        self.parent_run_id = parent_run_id
+        self.timestamp = timestamp
+        self.message = message
+        self.input = input
+        self.output = output
+        self.error = error
+        self.feedback = feedback
+        self.runtime = runtime
+        self.token_usage = token_usage
+        self.metadata = metadata
+        self.params = params
+        self.template_id = template_id
+        self.app_id = app_id
+        self.api_url = api_url
+
+    def to_dict(self) -> dict:
+        """The event as sent to the API. `api_url` is only used to route it, and left out."""
+        # A literal is about twice as fast as building the dict from WIRE_FIELDS
+        return {
+            "event": self.event,
+            "type": self.type,
+            "name": self.name,
+            "userId": self.user_id,
+            "userProps": self.user_props,
+            "tags": self.tags,
+            "threadTags": self.thread_tags,
+            "runId": self.run_id,
+            "parentRunId": self.parent_run_id,
+            "timestamp": self.timestamp,
+            "message": self.message,
+            "input": self.input,
+            "output": self.output,
+            "error": self.error,
+            "feedback": self.feedback,
+            "runtime": self.runtime,
+            "tokensUsage": self.token_usage,
+            "metadata": self.metadata,
+            "params": self.params,
+            "templateId": self.template_id,
+            "appId": self.app_id,
+        }
+
+    def get(self, key: str, default=None):
+        slot = _SLOTS_BY_KEY.get(key)
+        value = None if slot is None else getattr(self, slot)
+        return default if value is None else value
+
+    def __getitem__(self, key: str):
+        if key not in _SLOTS_BY_KEY:
+            raise KeyError(key)
+        return getattr(self, _SLOTS_BY_KEY[key])
+
+    def __repr__(self):
+        return f"Event({self.to_dict()!r})"
+
+
+def encode_event(event, serializer) -> EncodedEvent:
+    if isinstance(event, EncodedEvent):
+        return event
+    if isinstance(event, Event):
+        return EncodedEvent(serializer.dumps(event.to_dict()), event.app_id, event.api_url, event.run_id)
+
+    api_url = event.get("apiUrl")
+    if api_url is not None:
+        # Only used to route the event, the API does not expect it
+        event = {key: value for key, value in event.items() if key != "apiUrl"}
+    return EncodedEvent(serializer.dumps(event), event.get("appId"), api_url, event.get("runId"))
+
+
+def event_route(event) -> tuple:
+    """(app_id, api_url) of an event, both None when the defaults must be used."""
+    if isinstance(event, EncodedEvent):
+        return event.app_id, event.api_url
+    return event.get("appId"), event.get("apiUrl")
+
+
+def event_run_id(event):
+    if isinstance(event, EncodedEvent):
+        return event.run_id
+    return event.get("runId")
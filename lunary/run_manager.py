@@ -1,6 +1,7 @@
 import logging
 from typing import Optional, Dict, List
 from uuid import uuid4, UUID
+from . import sampling
 
 RunID = str | UUID
 
@@ -9,6 +10,8 @@ class Run:
         self.id: str = run_id or str(uuid4())
         self.parent_run_id: str | None = parent_run_id
         self.children: List[Run] = []
+        self.sampled: bool = True
+        self.trace_id: str = self.id
 
 class RunManager:
     def __init__(self):
@@ -26,7 +29,13 @@ class RunManager:
         """Safely get the ID of the current run, or None if there is no current run."""
         return self._current_run.id if self._current_run else None
 
-    def start_run(self, run_id: RunID | None = None, parent_run_id: RunID | None = None) -> Run | None:
+    def start_run(self, run_id: RunID | None = None, parent_run_id: RunID | None = None,
+                  run_type: str | None = None, name: str | None = None, tags: List[str] | None = None) -> Run | None:
+        """
+        Starts a run, child of `parent_run_id` or of the current run. The sampling decision
+        is taken at the root run of a trace, from `run_type`, `name` and `tags`, and
+        inherited by its children.
+        """
         if parent_run_id is None and self._current_run is not None:
             parent_run_id = self._current_run.id
 
@@ -39,18 +48,27 @@ class RunManager:
         if isinstance(parent_run_id, UUID):
             parent_run_id = str(parent_run_id)
 
+        external_parent_id = None
         if not self._run_exists(parent_run_id):
             # in Langchain CallbackHandler, sometimes it pass a parent_run_id for run that do not exist. 
             # Those runs should be ignored by Lunary
-            parent_run_id = None
+            external_parent_id, parent_run_id = parent_run_id, None
 
         run = Run(run_id, parent_run_id)
         self.runs[run.id] = run
 
-        if parent_run_id:
-            parent_run = self.runs.get(parent_run_id)
-            if parent_run:
-                parent_run.children.append(run)
+        parent_run = self.runs.get(parent_run_id) if parent_run_id else None
+        if parent_run:
+            parent_run.children.append(run)
+            run.sampled = parent_run.sampled
+            run.trace_id = parent_run.trace_id
+        elif sampling.is_sampling():
+            # A parent tracked elsewhere is the root of the trace: decide from its id
+            run.sampled = sampling.sample_root(external_parent_id or run.id, run_type, name, tags)
+        if not run.sampled:
+            sampling.unsampled_runs.add(run.id)
+        elif sampling.is_sampling():
+            sampling.sampled_runs.add(run.id)
 
         if self._current_run:
             self._run_stack.append(self._current_run)
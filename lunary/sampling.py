@@ -0,0 +1,121 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from .config import get_config
+
+
+def sample_rate(config, run_type=None, name=None, tags=None) -> float:
+    """
+    The rate of the first matching rule of `config.sampling_rules`, checked by name,
+    then by tag, then by run type, or `config.sample_rate`.
+    """
+    rules = config.sampling_rules
+    if rules:
+        if name is not None and f"name:{name}" in rules:
+            return rules[f"name:{name}"]
+        for tag in tags or ():
+            if f"tag:{tag}" in rules:
+                return rules[f"tag:{tag}"]
+        if run_type is not None and f"type:{run_type}" in rules:
+            return rules[f"type:{run_type}"]
+    return config.sample_rate
+
+
+def decide(trace_id: str, rate: float) -> bool:
+    """
+    Whether to keep a trace. Derived from its id rather than drawn at random, so that
+    every process seeing the same trace takes the same decision.
+    """
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    digest = hashlib.blake2b(trace_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") < rate * 2 ** 64
+
+
+class RecentRuns:
+    """
+    Bounded set of run ids, oldest evicted first once there are more than
+    `config.sampling_cache_size`.
+    """
+
+    def __init__(self):
+        self.run_ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.run_ids)
+
+    def __contains__(self, run_id) -> bool:
+        return run_id is not None and str(run_id) in self.run_ids
+
+    def add(self, run_id) -> None:
+        with self.lock:
+            self.run_ids[str(run_id)] = None
+            while len(self.run_ids) > get_config().sampling_cache_size:
+                self.run_ids.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.run_ids.clear()
+
+    def reset_lock(self) -> None:
+        """Called in forked children, where the parent's lock may be held forever. The decisions still hold."""
+        self.lock = threading.Lock()
+
+
+# The decisions taken for the runs of the traces seen by this process, remembered so the
+# events reported later for them (feedback, thread messages, LangChain callbacks) follow
+# them. Each set holds the last `config.sampling_cache_size` runs (100,000 by default,
+# under 20 minutes at 100 runs per second), see `should_track` for the older ones.
+unsampled_runs = RecentRuns()
+sampled_runs = RecentRuns()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=unsampled_runs.reset_lock)
+    os.register_at_fork(after_in_child=sampled_runs.reset_lock)
+
+
+def is_sampling() -> bool:
+    config = get_config()
+    return config.sample_rate < 1 or bool(config.sampling_rules) or len(unsampled_runs) > 0
+
+
+def sample_root(trace_id: str, run_type=None, name=None, tags=None) -> bool:
+    """Takes the decision for a trace, at its root run."""
+    if trace_id in unsampled_runs:
+        return False
+    config = get_config()
+    return decide(str(trace_id), sample_rate(config, run_type, name, tags))
+
+
+def should_track(run_id, parent_run_id=None, run_type=None, name=None, tags=None) -> bool:
+    """
+    Whether `track_event` should report an event, according to the decision taken for
+    its trace: the run or its parent was left out, or, for thread messages, which have
+    no root run, the thread is.
+
+    Events reported once a run is over (feedback, without a run type) may come after its
+    decision left `unsampled_runs` and `sampled_runs`, or from another process: they are
+    decided from the run id and `config.sample_rate`, as a root run without a matching
+    sampling rule is. Those for the children of a trace are then kept at that rate,
+    independently of their trace.
+    """
+    if not is_sampling():
+        return True
+    if run_id in unsampled_runs or parent_run_id in unsampled_runs:
+        unsampled_runs.add(run_id)
+        return False
+    # Not by name: that of a thread event is the event's, not the thread's
+    if run_type == "thread" and parent_run_id is not None:
+        if not sample_root(parent_run_id, run_type, tags=tags):
+            unsampled_runs.add(run_id)
+            return False
+        sampled_runs.add(run_id)
+    if run_type is None and run_id is not None and run_id not in sampled_runs:
+        if not decide(str(run_id), get_config().sample_rate):
+            unsampled_runs.add(run_id)
+            return False
+    return True
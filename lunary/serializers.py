@@ -0,0 +1,80 @@
+import json
+import uuid
+from abc import ABC, abstractmethod
+from datetime import date, datetime, time
+import jsonpickle
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def to_json_compatible(obj):
+    """
+    `default` hook of the fast serializers: converts the types events commonly carry,
+    and falls back to jsonpickle's reflective flattening for anything else.
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return json.loads(jsonpickle.encode(obj, unpicklable=False))
+
+
+class Serializer(ABC):
+    """Turns an event into the UTF-8 encoded JSON sent to the Lunary API."""
+
+    name: str
+
+    @abstractmethod
+    def dumps(self, obj) -> bytes:
+        ...
+
+
+class JsonpickleSerializer(Serializer):
+    """Walks every object through jsonpickle's handler registry. Slowest, but handles anything."""
+
+    name = "jsonpickle"
+
+    def dumps(self, obj) -> bytes:
+        return jsonpickle.encode(obj, unpicklable=False).encode("utf-8")
+
+
+class JsonSerializer(Serializer):
+    name = "json"
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(default=to_json_compatible, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(self, obj) -> bytes:
+        return self.encoder.encode(obj).encode("utf-8")
+
+
+class OrjsonSerializer(Serializer):
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, default=to_json_compatible, option=orjson.OPT_NON_STR_KEYS)
+
+
+SERIALIZERS = {
+    serializer.name: serializer
+    for serializer in (JsonpickleSerializer, JsonSerializer, OrjsonSerializer)
+}
+
+
+def create_serializer(name: str | None = None) -> Serializer:
+    """Creates a serializer by name. Defaults to orjson when it is installed, the standard json module otherwise."""
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name not in SERIALIZERS:
+        raise ValueError(f"Invalid serializer {name!r}, expected one of {', '.join(SERIALIZERS)}")
+    if name == "orjson" and orjson is None:
+        raise ValueError("The orjson serializer requires the `orjson` package (`pip install orjson`)")
+    return SERIALIZERS[name]()
@@ -0,0 +1,52 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from .config import get_config
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_session_key: tuple | None = None
+
+
+def _create_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide HTTP session used to talk to the Lunary API.
+
+    Connections are kept alive and pooled (up to `config.http_pool_size` per host).
+    The session is rebuilt when the pool size changes or when called from a forked
+    child process, so sockets are never shared between processes.
+    """
+    global _session, _session_key
+
+    key = (os.getpid(), get_config().http_pool_size)
+    if _session is None or _session_key != key:
+        with _lock:
+            if _session is None or _session_key != key:
+                previous, previous_pid = _session, _session_key[0] if _session_key else None
+                _session = _create_session(key[1])
+                _session_key = key
+                if previous is not None and previous_pid == key[0]:
+                    previous.close()
+    return _session
+
+
+def _reset_after_fork() -> None:
+    # The parent's sockets must not be used (nor closed) by the child, and the lock
+    # may have been held by another thread at fork time.
+    global _lock, _session, _session_key
+    _lock = threading.Lock()
+    _session = None
+    _session_key = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import logging
+from .config import get_config
+from .events import EncodedEvent, encode_event
+
+logger = logging.getLogger(__name__)
+
+SPILL_FILE_NAME = re.compile(r"lunary-spill-(\d+)\.jsonl")
+
+
+class SpilledEvent(EncodedEvent):
+    """An event read back from the spill file, with the offset of its line, see `SpillFile.rewind`."""
+
+    __slots__ = ("offset", "index")
+
+    def __init__(self, data: bytes, route: list, offset: int, index: int):
+        super().__init__(data, *route)
+        self.offset = offset
+        # Number of events read from the file before this one
+        self.index = index
+
+
+class SpillFile:
+    """
+    Append-only file holding events evicted from a full EventQueue, one per line:
+    the JSON encoded [app_id, api_url, run_id] route, a tab, then the encoded event.
+    Events are read back in the order they were written, once the queue has room again.
+    Events read back that could not be sent are not written again: `rewind` moves the
+    read offset back to them. The file is deleted once every event in it was sent.
+
+    The file grows up to `max_bytes`, events spilled beyond that are dropped.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path = os.path.join(directory, f"lunary-spill-{os.getpid()}.jsonl")
+        self.offset = 0
+        self.pending = 0
+        self.size = 0
+        self.read_index = 0
+        remove_stale_spill_files(directory)
+
+    def write(self, events) -> int:
+        """Appends events, returns how many were written (not the ones over the quota)."""
+        os.makedirs(self.directory, exist_ok=True)
+        serializer = get_config().serializer
+        lines = []
+        room = self.max_bytes - self.size
+        for event in events:
+            try:
+                encoded = encode_event(event, serializer)
+                route = json.dumps([encoded.app_id, encoded.api_url, encoded.run_id]).encode("utf-8")
+                line = route + b"\t" + encoded.data + b"\n"
+            except Exception as e:
+                logger.warning(f"Could not spill event: {e}")
+                continue
+            if len(line) > room:
+                logger.warning(f"Spill file {self.path} is full, dropping {len(events) - len(lines)} events")
+                break
+            lines.append(line)
+            room -= len(line)
+
+        if lines:
+            with open(self.path, "ab") as file:
+                file.writelines(lines)
+            self.size = self.max_bytes - room
+            self.pending += len(lines)
+        return len(lines)
+
+    def read(self, limit: int) -> list[SpilledEvent]:
+        if self.pending == 0:
+            return []
+
+        events = []
+        try:
+            with open(self.path, "rb") as file:
+                file.seek(self.offset)
+                while len(events) < limit:
+                    offset = file.tell()
+                    line = file.readline()
+                    if not line:
+                        self.pending = len(events)
+                        break
+                    route, data = line.rstrip(b"\n").split(b"\t", 1)
+                    events.append(SpilledEvent(data, json.loads(route), offset, self.read_index))
+                    self.read_index += 1
+                self.offset = file.tell()
+        except FileNotFoundError:
+            logger.warning(f"Spill file {self.path} disappeared, {self.pending} events lost")
+            self.pending = len(events)
+
+        self.pending -= len(events)
+        return events
+
+    def rewind(self, events: list[SpilledEvent]) -> None:
+        """Moves the read offset back to the first of `events`, read but not sent, so they are read again."""
+        first = min(events, key=lambda event: event.index)
+        if first.index >= self.read_index:
+            return
+        self.pending += self.read_index - first.index
+        self.offset, self.read_index = first.offset, first.index
+
+    def clear(self) -> None:
+        self.pending = 0
+        self.offset = 0
+        self.size = 0
+        self.read_index = 0
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_spill_files(directory: str) -> None:
+    """Deletes the spill files of processes that exited: no other process reads them."""
+    if os.name != "posix":
+        # Only POSIX can check whether a process exists without side effects
+        return
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        match = SPILL_FILE_NAME.fullmatch(name)
+        if match is None or int(match.group(1)) == os.getpid():
+            continue
+        try:
+            os.kill(int(match.group(1)), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except OSError:
+            # Exists, but belongs to another user
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
@@ -0,0 +1,242 @@
+import os
+import mmap
+import time
+import zlib
+import json
+import struct
+import logging
+from .events import EncodedEvent
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Every record is prefixed with the length and the CRC32 of its payload, so a record
+# torn by a crash is detected instead of being sent truncated
+HEADER = struct.Struct("<II")
+SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+class SpooledEvent(EncodedEvent):
+    """An event read from the spool, with the position of its record, see `Spool.rewind`."""
+
+    __slots__ = ("seq", "offset", "index")
+
+    def __init__(self, data: bytes, route: list, seq: int, offset: int, index: int):
+        super().__init__(data, *route)
+        self.seq = seq
+        self.offset = offset
+        # Number of events read from the spool before this one
+        self.index = index
+
+
+class Spool:
+    """
+    Write-ahead log of the events waiting to be sent, so they survive a crash or a
+    restart of the process.
+
+    Events are appended to segment files of about `SEGMENT_BYTES`. Writes are fsynced
+    at most every `fsync_interval` seconds (0 to fsync every write). Reads go through a
+    memory map and advance a read position; `commit` persists it once the events read
+    were sent, and deletes the segments left behind. Events read but not committed are
+    sent again after a restart: delivery is at least once. Events that could not be sent
+    are not kept in memory: `rewind` moves the read position back to them.
+
+    When the spool grows over `max_bytes`, its oldest segments are deleted.
+    A spool directory can only be used by one process at a time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, fsync_interval: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock_file = open(os.path.join(directory, "lock"), "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.lock_file.close()
+                raise
+
+        self.sizes = {
+            int(name[:-4]): os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory)
+            if name.endswith(".seg") and name[:-4].isdigit()
+        }
+        self.read_seq, self.read_offset = self._load_cursor()
+        if self.read_seq not in self.sizes:
+            later = [seq for seq in self.sizes if seq > self.read_seq]
+            self.read_seq, self.read_offset = min(later, default=self.read_seq), 0
+        self.committed = (self.read_seq, self.read_offset)
+        self.file = None
+        self.write_seq = None
+        self.synced_at = time.monotonic()
+        self.dropped = 0
+        self.read_index = 0
+        self.pending = sum(
+            len(self._read_segment(seq, self.read_offset if seq == self.read_seq else 0)[0])
+            for seq in self.sizes
+            if seq >= self.read_seq
+        )
+
+    @property
+    def size(self) -> int:
+        return sum(self.sizes.values())
+
+    def append(self, events: list[EncodedEvent]) -> int:
+        """Writes encoded events, returns how many were written (none if over the quota)."""
+        records = []
+        for event in events:
+            payload = json.dumps([event.app_id, event.api_url, event.run_id]).encode("utf-8") + b"\t" + event.data
+            records.append(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        data = b"".join(records)
+
+        if self.file is None or self.sizes[self.write_seq] >= SEGMENT_BYTES:
+            self._rotate()
+        if not self._make_room(len(data)):
+            return 0
+
+        self.file.write(data)
+        # Flushed to the OS right away, so the memory map of the reader sees it
+        self.file.flush()
+        self.sizes[self.write_seq] += len(data)
+        self.pending += len(records)
+        if time.monotonic() - self.synced_at >= self.fsync_interval:
+            self.sync()
+        return len(records)
+
+    def read(self, limit: int) -> list[EncodedEvent]:
+        events = []
+        while len(events) < limit and self.read_seq in self.sizes:
+            records, self.read_offset = self._read_segment(self.read_seq, self.read_offset, limit - len(events))
+            for offset, payload in records:
+                route, data = payload.split(b"\t", 1)
+                events.append(SpooledEvent(data, json.loads(route), self.read_seq, offset, self.read_index))
+                self.read_index += 1
+            if len(events) >= limit:
+                break
+
+            later = [seq for seq in self.sizes if seq > self.read_seq]
+            if self.read_seq == self.write_seq or not later:
+                break
+            self.read_seq, self.read_offset = min(later), 0
+
+        self.pending -= len(events)
+        return events
+
+    def rewind(self, events: list[SpooledEvent]) -> None:
+        """
+        Moves the read position back to the first of `events`, read but not sent, so they
+        are read again from disk once they can be retried. The events read after it are
+        read again too, even if they were sent. Events of a segment deleted in the
+        meantime to stay under the quota are dropped.
+        """
+        kept = [event for event in events if event.seq in self.sizes]
+        if len(kept) < len(events):
+            logger.warning(f"Spool {self.directory} is full, dropping {len(events) - len(kept)} events")
+            self.dropped += len(events) - len(kept)
+        first = min(kept, key=lambda event: event.index, default=None)
+        if first is None or first.index >= self.read_index:
+            return
+        self.pending += self.read_index - first.index
+        self.read_seq, self.read_offset, self.read_index = first.seq, first.offset, first.index
+
+    def commit(self) -> None:
+        """Marks the events read so far as sent."""
+        if self.committed == (self.read_seq, self.read_offset):
+            return
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as file:
+            file.write(f"{self.read_seq} {self.read_offset}")
+        os.replace(path + ".tmp", path)
+        self.committed = (self.read_seq, self.read_offset)
+
+        for seq in [seq for seq in self.sizes if seq < self.read_seq]:
+            self._delete(seq)
+
+    def sync(self) -> None:
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+        self.synced_at = time.monotonic()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+        self.lock_file.close()
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:012d}.seg")
+
+    def _load_cursor(self) -> tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, "cursor")) as file:
+                seq, offset = map(int, file.read().split())
+                return seq, offset
+        except (OSError, ValueError):
+            return min(self.sizes, default=0), 0
+
+    def _rotate(self) -> None:
+        """Starts a new segment. Never appends to a segment of a previous run, it may end with a torn record."""
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+        self.write_seq = max(max(self.sizes, default=-1) + 1, self.read_seq)
+        self.file = open(self._path(self.write_seq), "ab")
+        self.sizes[self.write_seq] = 0
+
+    def _make_room(self, size: int) -> bool:
+        """Deletes the oldest segments until `size` more bytes fit in the quota."""
+        while self.size + size > self.max_bytes:
+            oldest = min(self.sizes)
+            if oldest == self.write_seq:
+                logger.warning(f"Spool {self.directory} is full, dropping events")
+                return False
+
+            if oldest >= self.read_seq:
+                unread = len(self._read_segment(oldest, self.read_offset if oldest == self.read_seq else 0)[0])
+                logger.warning(f"Spool {self.directory} is full, dropping {unread} events")
+                self.pending -= unread
+                self.dropped += unread
+            if oldest == self.read_seq:
+                self.read_seq, self.read_offset = min(seq for seq in self.sizes if seq > oldest), 0
+            self._delete(oldest)
+        return True
+
+    def _delete(self, seq: int) -> None:
+        del self.sizes[seq]
+        try:
+            os.remove(self._path(seq))
+        except FileNotFoundError:
+            pass
+
+    def _read_segment(self, seq: int, offset: int, limit: int | None = None) -> tuple[list[tuple[int, bytes]], int]:
+        """
+        Reads up to `limit` records from `offset`, returns their (offset, payload) with the
+        offset of the next record.
+        """
+        payloads = []
+        try:
+            with open(self._path(seq), "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if size <= offset:
+                    return payloads, offset
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    while offset + HEADER.size <= size and (limit is None or len(payloads) < limit):
+                        length, crc = HEADER.unpack_from(view, offset)
+                        start = offset + HEADER.size
+                        payload = view[start:start + length]
+                        if len(payload) < length or zlib.crc32(payload) != crc:
+                            logger.warning(f"Spool segment {self._path(seq)} ends with a torn record, skipping it")
+                            return payloads, size
+                        payloads.append((offset, payload))
+                        offset = start + length
+        except FileNotFoundError:
+            logger.warning(f"Spool segment {self._path(seq)} disappeared")
+        return payloads, offset
@@ -0,0 +1,279 @@
+import os
+import time
+import logging
+import threading
+from queue import SimpleQueue
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StreamTimer:
+    """Times a stream: time to the first token, between tokens, and in total."""
+
+    __slots__ = ("started_at", "first_at", "last_at", "gaps")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_at = None
+        self.last_at = None
+        self.gaps = []
+
+    def tick(self) -> None:
+        """Records the arrival of a chunk carrying output."""
+        now = time.perf_counter()
+        if self.first_at is None:
+            self.first_at = now
+        else:
+            self.gaps.append(now - self.last_at)
+        self.last_at = now
+
+    def metrics(self) -> dict:
+        """The timings of the stream, in milliseconds, as reported in the end event metadata."""
+        duration = time.perf_counter() - self.started_at
+        gaps = sorted(self.gaps)
+        return {
+            "timeToFirstTokenMs": round((self.first_at - self.started_at) * 1000, 1) if self.first_at is not None else None,
+            "interTokenLatencyMs": {
+                f"p{round(q * 100)}": round(percentile(gaps, q) * 1000, 1) for q in (0.5, 0.9, 0.99)
+            } if gaps else None,
+            "durationMs": round(duration * 1000, 1),
+        }
+
+
+class StreamProgress:
+    """
+    Reports the output of a stream while it runs, coalescing the text received since
+    the last report into a single delta, at most once every `interval` seconds. What
+    is left when the stream ends is not reported: the end event has the whole output.
+    """
+
+    __slots__ = ("emit", "interval", "pending", "offset", "next_at")
+
+    def __init__(self, emit, interval: float):
+        self.emit = emit
+        self.interval = interval
+        self.pending = []
+        self.offset = 0
+        self.next_at = time.monotonic() + interval
+
+    def add(self, text: str) -> None:
+        self.pending.append(text)
+        now = time.monotonic()
+        if now >= self.next_at:
+            delta = "".join(self.pending)
+            self.pending.clear()
+            self.emit(delta, self.offset)
+            self.offset += len(delta)
+            self.next_at = now + self.interval
+
+
+class ToolCallFragments:
+    __slots__ = ("index", "id", "type", "name", "arguments")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.id = None
+        self.type = None
+        self.name = None
+        self.arguments = []
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "id": self.id,
+            "function": {"arguments": "".join(self.arguments), "name": self.name},
+            "type": self.type,
+        }
+
+
+class ChoiceFragments:
+    __slots__ = ("role", "content", "function_name", "function_arguments", "tool_calls")
+
+    def __init__(self):
+        self.role = None
+        self.content = []
+        self.function_name = None
+        self.function_arguments = None
+        self.tool_calls: dict[int, ToolCallFragments] = {}
+
+    def to_message(self) -> dict:
+        function_call = {}
+        if self.function_name is not None:
+            function_call["name"] = self.function_name
+        if self.function_arguments is not None:
+            function_call["arguments"] = "".join(self.function_arguments)
+        return {
+            "role": self.role,
+            "content": "".join(self.content),
+            "function_call": function_call,
+            "tool_calls": [self.tool_calls[index].to_dict() for index in sorted(self.tool_calls)],
+        }
+
+
+class StreamAccumulator:
+    """
+    Collects the deltas of a streamed OpenAI chat completion, per choice and per tool
+    call, and joins them once, when the message is asked for: growing strings chunk by
+    chunk is quadratic on long streams.
+    """
+
+    def __init__(self, progress: StreamProgress | None = None):
+        self.choices: dict[int, ChoiceFragments] = {}
+        self.chunks = 0
+        self.usage = None
+        self.timer = StreamTimer()
+        self.progress = progress
+
+    def add(self, chunk) -> None:
+        self.chunks += 1
+        # Sent in a last chunk with `stream_options={"include_usage": True}`
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self.usage = usage
+        # No choices in the first chunk with Azure, nor in the usage chunk
+        for choice in chunk.choices or ():
+            fragments = self.choices.get(choice.index)
+            if fragments is None:
+                fragments = self.choices[choice.index] = ChoiceFragments()
+
+            delta = choice.delta
+            if delta.role:
+                fragments.role = delta.role
+            if delta.content:
+                fragments.content.append(delta.content)
+                self.timer.tick()
+                if self.progress is not None and choice.index == 0:
+                    self.progress.add(delta.content)
+
+            function_call = getattr(delta, "function_call", None)
+            if function_call is not None:
+                if function_call.name:
+                    fragments.function_name = function_call.name
+                if function_call.arguments is not None:
+                    if fragments.function_arguments is None:
+                        fragments.function_arguments = []
+                    fragments.function_arguments.append(function_call.arguments)
+                    self.timer.tick()
+
+            for tool_call in delta.tool_calls or ():
+                call = fragments.tool_calls.get(tool_call.index)
+                if call is None:
+                    call = fragments.tool_calls[tool_call.index] = ToolCallFragments(tool_call.index)
+                if tool_call.id:
+                    call.id = tool_call.id
+                if tool_call.type:
+                    call.type = tool_call.type
+                function = tool_call.function
+                if function is not None:
+                    if function.name:
+                        call.name = function.name
+                    if function.arguments:
+                        call.arguments.append(function.arguments)
+                        self.timer.tick()
+
+    def add_content(self, content: str) -> None:
+        """Adds the content of a chunk, kept by `compact_chunk` instead of the chunk."""
+        self.chunks += 1
+        fragments = self.choices.get(0)
+        if fragments is None:
+            fragments = self.choices[0] = ChoiceFragments()
+        fragments.content.append(content)
+
+    @classmethod
+    def replay(cls, captured: list) -> "StreamAccumulator":
+        """Accumulates the chunks, or contents, captured by a pass-through stream."""
+        accumulator = cls()
+        for item in captured:
+            if isinstance(item, str):
+                accumulator.add_content(item)
+            else:
+                accumulator.add(item)
+        return accumulator
+
+    def message(self, index: int = 0) -> dict:
+        """The message of a choice, as the non-streamed completion would have it."""
+        fragments = self.choices.get(index) or ChoiceFragments()
+        return fragments.to_message()
+
+    def token_usage(self) -> dict:
+        """
+        The usage sent by the API, when asked for with `stream_options`. Otherwise
+        unknown: the number of chunks is not that of tokens, it is left to the server.
+        """
+        if self.usage is None:
+            return {"completion": None, "prompt": None}
+        return {"completion": self.usage.completion_tokens, "prompt": self.usage.prompt_tokens}
+
+    def metadata(self) -> dict:
+        return {"streaming": {**self.timer.metrics(), "chunks": self.chunks}}
+
+
+def compact_chunk(chunk):
+    """
+    The content of a chunk when it is all there is to it, to keep instead of the chunk
+    in the `deltas` pass-through mode, otherwise the chunk itself.
+    """
+    choices = chunk.choices
+    if len(choices) == 1 and getattr(chunk, "usage", None) is None:
+        choice = choices[0]
+        delta = choice.delta
+        content = delta.content
+        if content and choice.index == 0 and delta.role is None and delta.tool_calls is None and delta.function_call is None:
+            return content
+    return chunk
+
+
+class StreamFinisher(threading.Thread):
+    """
+    Parses the chunks captured by pass-through streams and tracks their end event, in
+    the background, once the streams have been delivered.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True, name="lunary-stream-finisher")
+        self.pid = os.getpid()
+        self.pending = SimpleQueue()
+
+    def put(self, job) -> None:
+        self.pending.put(job)
+
+    def run(self):
+        while True:
+            job = self.pending.get()
+            try:
+                job()
+            except Exception as e:
+                logger.exception(f"Could not track the end of a stream: {e}")
+
+    def drain(self, timeout: float) -> bool:
+        """Waits until every stream handed over so far is tracked."""
+        barrier = threading.Event()
+        self.pending.put(barrier.set)
+        return barrier.wait(timeout)
+
+
+_finisher = None
+_finisher_lock = threading.Lock()
+
+
+def finish_in_background(job) -> None:
+    global _finisher
+    # Started again in forked children, where the thread does not exist
+    if _finisher is None or _finisher.pid != os.getpid():
+        with _finisher_lock:
+            if _finisher is None or _finisher.pid != os.getpid():
+                _finisher = StreamFinisher()
+                _finisher.start()
+    _finisher.put(job)
+
+
+def drain_finisher(timeout: float) -> bool:
+    finisher = _finisher
+    if finisher is None or finisher.pid != os.getpid():
+        return True
+    return finisher.drain(timeout)
@@ -0,0 +1,186 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from .config import get_config
+from .sampling import unsampled_runs
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """The events of a trace held back until it is decided, and what is known of it so far."""
+
+    __slots__ = ("id", "started_at", "events", "run_ids", "errored", "flagged", "tokens")
+
+    def __init__(self, trace_id: str, started_at: float):
+        self.id = trace_id
+        self.started_at = started_at
+        self.events = []  # (queue, event)
+        self.run_ids = set()
+        self.errored = False
+        self.flagged = False
+        self.tokens = 0
+
+    def add(self, run_id: str, event, target) -> None:
+        self.events.append((target, event))
+        self.run_ids.add(run_id)
+        if event.event == "error" or event.error is not None:
+            self.errored = True
+        elif event.event == "feedback":
+            self.flagged = True
+        if event.token_usage:
+            self.tokens += sum(value for value in event.token_usage.values() if isinstance(value, (int, float)))
+
+    def keep(self, config, now: float) -> bool:
+        latency_threshold = config.tail_latency_threshold
+        tokens_threshold = config.tail_tokens_threshold
+        return (
+            self.errored
+            or self.flagged
+            or (latency_threshold is not None and now - self.started_at >= latency_threshold)
+            or (tokens_threshold is not None and self.tokens >= tokens_threshold)
+        )
+
+
+class TraceBuffer:
+    """
+    Holds the events of each trace until its root run ends, then sends them if the
+    trace is worth keeping: a run errored, it was flagged by feedback or `score`, or it
+    took more than `tail_latency_threshold` seconds or `tail_tokens_threshold` tokens.
+    The other traces are dropped, and the events reported for them later on as well.
+
+    Traces are started by the start event of a root run of the RunManager, other events
+    are sent as usual. Traces still running after `tail_trace_timeout` (checked by a
+    background thread while traces are held), or the oldest ones once `tail_max_events`
+    events are held, are decided on what is known so far, and so are all the traces
+    still held when the interpreter exits.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        (Re)creates the lock and the buffers. Called again in forked children: the held
+        traces belong to the parent, which decides them, and its lock may be held forever.
+        """
+        self.traces: OrderedDict[str, Trace] = OrderedDict()
+        self.trace_of: dict[str, str] = {}
+        self.buffered = 0
+        self.lock = threading.Lock()
+        self.reaper = None
+        # When the reaper thread wakes up next, woken up earlier by a trace that times out before
+        self.reap_at = float("inf")
+        self.reap_sooner = threading.Condition(self.lock)
+
+    def __len__(self):
+        return self.buffered
+
+    def add(self, run_id: str, trace_id: str | None, event, target) -> bool:
+        """Holds back an event of a trace, returns False if it should be sent right away."""
+        config = get_config()
+        now = time.monotonic()
+        with self.lock:
+            trace = self.traces.get(self.trace_of.get(run_id) or trace_id)
+            if trace is None:
+                if run_id != trace_id or event.event != "start":
+                    return False
+                trace = self.traces[trace_id] = Trace(trace_id, now)
+                self._watch(now + config.tail_trace_timeout)
+            trace.add(run_id, event, target)
+            self.trace_of[run_id] = trace.id
+            self.buffered += 1
+
+            done = []
+            if run_id == trace.id and event.event in ("end", "error"):
+                done.append(self._pop(trace))
+            done += self._pop_expired(config, now)
+        self._release(done, config, now)
+        return True
+
+    def flag(self, run_id: str) -> None:
+        """Keeps the trace of a run, e.g. when it is scored."""
+        with self.lock:
+            trace = self.traces.get(self.trace_of.get(run_id))
+            if trace is not None:
+                trace.flagged = True
+
+    def release_all(self) -> None:
+        """Decides all the traces still held, on what is known so far."""
+        with self.lock:
+            done = [self._pop(trace) for trace in list(self.traces.values())]
+        self._release(done, get_config(), time.monotonic())
+
+    def release_expired(self) -> None:
+        """Decides the traces running for more than `tail_trace_timeout`, and those over `tail_max_events`."""
+        config = get_config()
+        now = time.monotonic()
+        with self.lock:
+            done = self._pop_expired(config, now)
+        self._release(done, config, now)
+
+    def _watch(self, timeout_at: float) -> None:
+        """
+        Called with the lock held when a trace starts. Starts the thread deciding the
+        traces that time out, and makes sure the held traces are decided at exit before
+        the Consumer sends its last batch: exit handlers run last registered first, and
+        Consumers may be created after this module is imported.
+        """
+        atexit.unregister(self.release_all)
+        atexit.register(self.release_all)
+        if self.reaper is None:
+            self.reaper = threading.Thread(target=self._reap, daemon=True, name="lunary-tail-sampling")
+            self.reaper.start()
+        elif timeout_at < self.reap_at:
+            # `tail_trace_timeout` was lowered
+            self.reap_sooner.notify()
+
+    def _reap(self) -> None:
+        while True:
+            config = get_config()
+            now = time.monotonic()
+            with self.lock:
+                done = self._pop_expired(config, now)
+                oldest = next(iter(self.traces.values()), None)
+                if oldest is None:
+                    self.reaper = None
+                    self.reap_at = float("inf")
+                elif not done:
+                    self.reap_at = oldest.started_at + config.tail_trace_timeout
+                    self.reap_sooner.wait(self.reap_at - now)
+            self._release(done, config, now)
+            if oldest is None:
+                return
+
+    def _pop_expired(self, config, now: float) -> list[Trace]:
+        expired = []
+        for trace in list(self.traces.values()):
+            if self.buffered <= config.tail_max_events and now - trace.started_at < config.tail_trace_timeout:
+                break
+            expired.append(self._pop(trace))
+        return expired
+
+    def _pop(self, trace: Trace) -> Trace:
+        del self.traces[trace.id]
+        for run_id in trace.run_ids:
+            self.trace_of.pop(run_id, None)
+        self.buffered -= len(trace.events)
+        return trace
+
+    def _release(self, traces: list[Trace], config, now: float) -> None:
+        for trace in traces:
+            if trace.keep(config, now):
+                for target, event in trace.events:
+                    target.append(event)
+            else:
+                for run_id in trace.run_ids:
+                    unsampled_runs.add(run_id)
+
+
+trace_buffer = TraceBuffer()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=trace_buffer.reset)
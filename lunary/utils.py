@@ -1,4 +1,7 @@
-import uuid, hashlib 
+import uuid, hashlib, functools
+
+# Run ids derived and kept in cache, enough for the open runs of a busy process
+RUN_ID_CACHE_SIZE = 65536
 
 def clean_nones(value):
     """
@@ -20,10 +23,13 @@ def clean_nones(value):
         return value  
 
 def create_uuid_from_string(seed_string):
-    seed_bytes = seed_string.encode('utf-8')
-    sha256_hash = hashlib.sha256()
-    sha256_hash.update(seed_bytes)
-    hash_hex = sha256_hash.hexdigest()
-    uuid_hex = hash_hex[:32]
-    uuid_obj = uuid.UUID(uuid_hex)
-    return uuid_obj
+    # The first 16 bytes of the digest, same as parsing the first 32 hex characters
+    return uuid.UUID(bytes=hashlib.sha256(seed_string.encode('utf-8')).digest()[:16])
+
+@functools.lru_cache(maxsize=RUN_ID_CACHE_SIZE)
+def derive_run_id(run_id: str, project_id: str) -> str:
+    """
+    The id of a run within a project, unique by run_id / project_id pair. Cached, as a
+    run is tracked by its start and end events and as the parent of each of its children.
+    """
+    return str(create_uuid_from_string(run_id + project_id))
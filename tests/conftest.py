@@ -0,0 +1,85 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lunary.config import get_config
+
+
+def make_events(n, **extra):
+    return [{"event": "start", "runId": str(i), **extra} for i in range(n)]
+
+
+class IngestServer(ThreadingHTTPServer):
+    """Local stand-in for the Lunary ingest endpoint, recording every request it receives."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), IngestHandler)
+        self.requests = []
+        self.respond = lambda events: 200
+        self.accept_gzip = True
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def events(self):
+        with self.lock:
+            return [event for request in self.requests if request["status"] < 300 for event in request["events"]]
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            if not self.server.accept_gzip:
+                return self.reply(415)
+            body = gzip.decompress(body)
+        events = json.loads(body)["events"]
+        status = self.server.respond(events)
+        with self.server.lock:
+            self.server.requests.append({"headers": dict(self.headers), "events": events, "status": status})
+        self.reply(status)
+
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ingest_server():
+    server = IngestServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """The global config, every setting the test changes is restored after it."""
+    config = get_config()
+    for name, value in vars(config).items():
+        monkeypatch.setattr(config, name, value)
+    return config
+
+
+@pytest.fixture
+def ingest_config(config, ingest_server):
+    """The config, sending the events to `ingest_server`."""
+    config.api_url = ingest_server.url
+    config.app_id = "test-app-id"
+    return config
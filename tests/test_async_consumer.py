@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import pytest
+from lunary.event_queue import EventQueue
+from lunary.async_consumer import AsyncConsumer
+from .conftest import make_events
+
+
+async def wait_for_events(ingest_server, count, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if len(ingest_server.events) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_sends_from_the_event_loop(ingest_config, ingest_server):
+    ingest_config.flush_at = 5
+
+    async def main():
+        queue = EventQueue()
+        async with AsyncConsumer(queue):
+            queue.append(make_events(5))
+            await wait_for_events(ingest_server, 5)
+            assert len(ingest_server.events) == 5
+        return queue
+
+    queue = asyncio.run(main())
+    assert queue.consumer.ident is None
+    assert queue.stats()["sent"] == 5
+
+
+def test_wakes_on_events_from_other_threads(ingest_config, ingest_server):
+    ingest_config.flush_interval = 0.05
+
+    async def main():
+        queue = EventQueue()
+        async with AsyncConsumer(queue):
+            thread = threading.Thread(target=queue.append, args=(make_events(3),))
+            thread.start()
+            thread.join()
+            await wait_for_events(ingest_server, 3)
+            assert len(ingest_server.events) == 3
+
+    asyncio.run(main())
+
+
+def test_stop_sends_queued_events(ingest_config, ingest_server):
+    ingest_config.flush_interval = 60
+
+    async def main():
+        queue = EventQueue()
+        consumer = AsyncConsumer(queue)
+        await consumer.start()
+        queue.append(make_events(2))
+        await consumer.stop()
+
+    asyncio.run(main())
+    assert [e["runId"] for e in ingest_server.events] == ["0", "1"]
+
+
+def test_drain(ingest_config, ingest_server):
+    ingest_config.flush_interval = 60
+
+    async def main():
+        queue = EventQueue()
+        async with AsyncConsumer(queue):
+            queue.append(make_events(3))
+            result = await queue.drain(timeout=5)
+        return result
+
+    result = asyncio.run(main())
+    assert result.sent == 3 and result.pending == 0
+    assert len(ingest_server.events) == 3
+
+
+def test_sync_flush_goes_through_the_async_consumer(ingest_config, ingest_server):
+    ingest_config.flush_interval = 60
+
+    async def main():
+        queue = EventQueue()
+        async with AsyncConsumer(queue):
+            queue.append(make_events(3))
+            with pytest.raises(RuntimeError):
+                queue.flush(timeout=5)
+            result = await asyncio.to_thread(queue.flush, 5)
+        return queue, result
+
+    queue, result = asyncio.run(main())
+    assert result.sent == 3 and result.pending == 0
+    assert len(ingest_server.events) == 3
+    # The Consumer thread was left alone
+    assert queue.consumer.ident is None and queue.consumer.pending == 0
+
+
+def test_spool_io_runs_off_the_event_loop(ingest_config, ingest_server):
+    ingest_config.flush_at = 5
+    threads = []
+
+    async def main():
+        queue = EventQueue()
+        for name in ("get_batch", "commit"):
+            method = getattr(queue, name)
+            def recorded(*args, method=method, name=name):
+                threads.append((name, threading.get_ident()))
+                return method(*args)
+            setattr(queue, name, recorded)
+
+        async with AsyncConsumer(queue):
+            queue.append(make_events(5))
+            await wait_for_events(ingest_server, 5)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert {name for name, _ in threads} == {"get_batch", "commit"}
+    assert all(thread != loop_thread for _, thread in threads)
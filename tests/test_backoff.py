@@ -0,0 +1,39 @@
+import time
+from lunary.backoff import CircuitBreaker, backoff_delay, parse_retry_after, CLOSED, OPEN, HALF_OPEN
+
+
+def test_backoff_delay_grows_with_jitter():
+    delays = [backoff_delay(attempt, 1, 8) for attempt in range(1, 6)]
+    assert 0.5 <= delays[0] <= 1
+    assert 4 <= delays[-1] <= 8
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("garbage") is None
+    assert 0 <= parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") < 1
+
+
+def test_breaker_opens_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, base_delay=0.01, max_delay=0.01)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.acquire()
+
+    time.sleep(0.02)
+    assert breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.acquire()  # only one probe at a time
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.acquire()
+
+
+def test_breaker_respects_retry_after():
+    breaker = CircuitBreaker(base_delay=0.01, max_delay=0.01)
+    breaker.record_failure(retry_after=30)
+    assert not breaker.ready()
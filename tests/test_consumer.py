@@ -0,0 +1,270 @@
+import os
+import sys
+import time
+import json
+import asyncio
+import threading
+import subprocess
+import pytest
+import lunary
+from lunary.utils import derive_run_id
+from lunary.event_queue import EventQueue
+from lunary.streaming import finish_in_background
+from .conftest import make_events
+
+
+def test_batch_split_by_count(ingest_config, ingest_server):
+    ingest_config.max_batch_size = 10
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(25))
+    queue.consumer.send_batch()
+
+    assert sorted(len(r["events"]) for r in ingest_server.requests) == [5, 10, 10]
+    assert len(queue) == 0
+
+
+def test_batch_split_by_bytes(ingest_config, ingest_server):
+    ingest_config.max_batch_bytes = 1000
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(20, input="x" * 200))
+    queue.consumer.send_batch()
+
+    assert len(ingest_server.requests) > 1
+    assert len(ingest_server.events) == 20
+
+
+def test_poisoned_event_is_isolated(ingest_config, ingest_server):
+    ingest_server.respond = lambda events: 400 if any(e.get("input") == "poison" for e in events) else 200
+    queue = EventQueue(start_consumer=False)
+    events = make_events(8)
+    events[5]["input"] = "poison"
+    queue.append(events)
+    queue.consumer.send_batch()
+
+    assert sorted(e["runId"] for e in ingest_server.events) == ["0", "1", "2", "3", "4", "6", "7"]
+    assert queue.stats()["dropped"] == 1
+    assert len(queue) == 0
+
+
+def test_failed_chunk_is_requeued(ingest_config, ingest_server, monkeypatch):
+    monkeypatch.setattr(ingest_config, "sender_workers", 1)
+    ingest_config.max_batch_size = 2
+    ingest_server.respond = lambda events: 503 if events[0]["runId"] == "2" else 200
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(6))
+    queue.consumer.send_batch()
+
+    assert [e["runId"] for e in ingest_server.events] == ["0", "1"]
+    # the rest waits for the backoff delay to expire, in order
+    # encoded events are requeued as is, ready to be resent
+    assert [json.loads(e.data)["runId"] for e in queue.get_batch()] == ["2", "3", "4", "5"]
+
+
+def test_events_routed_by_project(ingest_config, ingest_server):
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(2) + make_events(3, appId="other-app-id"))
+    queue.consumer.send_batch()
+
+    tokens = sorted((r["headers"]["Authorization"], len(r["events"])) for r in ingest_server.requests)
+    assert tokens == [("Bearer other-app-id", 3), ("Bearer test-app-id", 2)]
+
+
+def test_custom_api_url_not_sent(ingest_config, ingest_server):
+    queue = EventQueue(start_consumer=False)
+    ingest_config.api_url = "http://127.0.0.1:1"
+    queue.append(make_events(2, apiUrl=ingest_server.url))
+    queue.consumer.send_batch()
+
+    assert len(ingest_server.events) == 2
+    assert all("apiUrl" not in event for event in ingest_server.events)
+
+
+def test_backs_off_after_failure(ingest_config, ingest_server):
+    ingest_server.respond = lambda events: 429
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(3))
+    queue.consumer.send_batch()
+    queue.consumer.send_batch()
+
+    assert len(ingest_server.requests) == 1
+    assert len(queue) == 3
+
+
+def test_gzip_compression(ingest_config, ingest_server):
+    ingest_config.compression = "gzip"
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(50, input="hello " * 50))
+    queue.consumer.send_batch()
+
+    assert ingest_server.requests[0]["headers"]["Content-Encoding"] == "gzip"
+    assert int(ingest_server.requests[0]["headers"]["Content-Length"]) < 2000
+    assert len(ingest_server.events) == 50
+
+
+def test_compression_fallback(ingest_config, ingest_server):
+    ingest_config.compression = "gzip"
+    ingest_server.accept_gzip = False
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(50, input="hello " * 50))
+    queue.consumer.send_batch()
+    queue.append(make_events(50, input="hello " * 50))
+    queue.consumer.send_batch()
+
+    assert len(ingest_server.events) == 100
+    assert all("Content-Encoding" not in r["headers"] for r in ingest_server.requests)
+
+
+def test_flush(ingest_config, ingest_server):
+    ingest_config.max_batch_size = 10
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(25))
+    result = queue.flush(timeout=5)
+
+    assert (result.sent, result.dropped, result.pending) == (25, 0, 0)
+    assert len(ingest_server.events) == 25
+
+
+def test_flush_times_out_while_backing_off(ingest_config, ingest_server):
+    ingest_server.respond = lambda events: 503
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(5))
+    result = queue.flush(timeout=0.2)
+
+    assert (result.sent, result.pending) == (0, 5)
+
+
+def test_flush_timeout_covers_every_stage(ingest_config, ingest_server, monkeypatch):
+    ingest_server.respond = lambda events: 503
+    queue = EventQueue(start_consumer=False)
+    monkeypatch.setattr(lunary, "queue", queue)
+    queue.append(make_events(5))
+    finish_in_background(lambda: time.sleep(0.5))
+
+    started = time.monotonic()
+    result = lunary.flush(timeout=0.3)
+
+    assert time.monotonic() - started < 0.45
+    assert result.pending == 5
+
+
+def test_flush_counts_the_batch_in_flight(ingest_config, ingest_server):
+    """Events the consumer thread is sending are neither sent nor gone: flush reports them as pending"""
+    ingest_config.flush_at = 1
+    sending = threading.Event()
+
+    def respond(events):
+        sending.set()
+        time.sleep(0.3)
+        return 200
+
+    ingest_server.respond = respond
+    queue = EventQueue()
+    queue.append(make_events(3))
+    assert sending.wait(5)
+
+    assert queue.flush(timeout=0.05).pending == 3
+    assert queue.flush(timeout=5) == (3, 0, 0)
+
+
+def test_aflush(ingest_config, ingest_server):
+    import lunary
+
+    lunary.track_event("llm", "start", run_id="run-1", name="gpt-4o", input="hello")
+    result = asyncio.run(lunary.aflush(timeout=5))
+
+    assert result.pending == 0
+    assert [e["name"] for e in ingest_server.events] == ["gpt-4o"]
+
+
+def wait_for_events(ingest_server, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(ingest_server.events) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return time.monotonic()
+
+
+def test_consumer_sends_when_batch_is_full(ingest_config, ingest_server):
+    ingest_config.flush_at = 10
+    ingest_config.flush_interval = 60
+    queue = EventQueue()
+    queue.append(make_events(5))
+    time.sleep(0.2)
+    assert ingest_server.events == []
+
+    queue.append(make_events(5))
+    wait_for_events(ingest_server, 10)
+    assert len(ingest_server.events) == 10
+    queue.consumer.stop()
+
+
+def test_consumer_sends_after_flush_interval(ingest_config, ingest_server):
+    ingest_config.flush_interval = 0.2
+    queue = EventQueue()
+    start = time.monotonic()
+    queue.append(make_events(1))
+    end = wait_for_events(ingest_server, 1)
+
+    assert len(ingest_server.events) == 1
+    assert 0.2 <= end - start < 2
+    queue.consumer.stop()
+
+
+def test_stop_wakes_idle_consumer(ingest_config, ingest_server):
+    queue = EventQueue()
+    queue.start_consumer_once()
+    start = time.monotonic()
+    queue.consumer.stop()
+
+    assert not queue.consumer.is_alive()
+    assert time.monotonic() - start < 1
+
+
+def test_sender_workers_keep_run_order(ingest_config, ingest_server, monkeypatch):
+    monkeypatch.setattr(ingest_config, "sender_workers", 4)
+    monkeypatch.setattr(ingest_config, "max_batch_size", 5)
+    monkeypatch.setattr(ingest_config, "retry_base_delay", 0.01)
+    failures = [1]
+    active = [0, 0]
+    lock = threading.Lock()
+
+    def respond(events):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+            failed = failures[0] > 0
+            failures[0] -= 1
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return 503 if failed else 200
+
+    ingest_server.respond = respond
+    queue = EventQueue(start_consumer=False)
+    for i in range(0, 40, 10):
+        queue.append([{"event": "start", "runId": str(j)} for j in range(i, i + 10)])
+        queue.consumer.send_batch(wait=False)
+        queue.append([{"event": "end", "runId": str(j)} for j in range(i, i + 10)])
+    result = queue.flush(timeout=5)
+
+    assert result.pending == 0
+    assert active[1] > 1
+    received = [(e["runId"], e["event"]) for e in ingest_server.events]
+    assert sorted(received) == sorted((str(i), event) for i in range(40) for event in ("start", "end"))
+    for i in range(40):
+        assert received.index((str(i), "start")) < received.index((str(i), "end"))
+
+
+@pytest.mark.parametrize("sender_workers", ["1", "4"])
+def test_events_sent_at_exit(ingest_server, sender_workers):
+    """Events still queued when the interpreter exits are sent by the atexit stop"""
+    script = 'import lunary; lunary.track_event("chain", "start", run_id="exit-run", name="exit")'
+    env = {
+        **os.environ,
+        "LUNARY_API_URL": ingest_server.url,
+        "LUNARY_APP_ID": "test-app-id",
+        "LUNARY_SENDER_WORKERS": sender_workers,
+        "LUNARY_FLUSH_INTERVAL": "60",
+    }
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, timeout=30)
+
+    assert [event["runId"] for event in ingest_server.events] == [derive_run_id("exit-run", "test-app-id")]
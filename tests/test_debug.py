@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+from lunary.debug import debug_sink
+from lunary.events import Event
+
+
+@pytest.fixture
+def debug_config(config, tmp_path):
+    config.debug_file = str(tmp_path / "events.log")
+    debug_sink.tokens = float("inf")
+    yield config
+    debug_sink.stop()
+
+
+def logged_run_ids(config):
+    debug_sink.stop()
+    with open(config.debug_file) as file:
+        return [line.split('"')[3] for line in file if '"runId"' in line]
+
+
+def test_rate_limited(debug_config):
+    debug_config.debug_rate_limit = 5
+    debug_config.debug_sample_rate = 1
+    for i in range(100):
+        debug_sink.log_event(Event(event="start", run_id=str(i)))
+
+    run_ids = logged_run_ids(debug_config)
+    assert run_ids[:5] == ["0", "1", "2", "3", "4"]
+    assert len(run_ids) < 10
+
+
+def test_sampled_out(debug_config):
+    debug_config.debug_sample_rate = 0
+    debug_sink.log_event(Event(event="start", run_id="run-1"))
+    debug_sink.start(debug_config)
+
+    assert logged_run_ids(debug_config) == []
+
+
+def test_app_handlers_receive_a_snapshot(debug_config, monkeypatch):
+    records = []
+
+    class Recorder(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    monkeypatch.setattr(debug_config, "debug_file", None)
+    debug_config.debug_rate_limit = 100
+    debug_config.debug_sample_rate = 1
+    handler = Recorder()
+    debug_sink.logger.addHandler(handler)
+    try:
+        event = Event(event="start", run_id="run-1", input={"question": "why"})
+        debug_sink.log_event(event)
+        event.input["question"] = "changed"
+        debug_sink.stop()
+    finally:
+        debug_sink.logger.removeHandler(handler)
+
+    assert debug_sink.logger.propagate
+    assert len(records) == 1
+    assert '"question": "why"' in records[0]
@@ -0,0 +1,66 @@
+from types import SimpleNamespace as NS
+
+import pytest
+import lunary
+from lunary.config import get_config
+
+
+class Recorder(list):
+    def append(self, event):
+        super().append(event.to_dict())
+
+
+@pytest.fixture
+def tracked(monkeypatch):
+    monkeypatch.setattr(get_config(), "app_id", "project")
+    events = Recorder()
+    monkeypatch.setattr(lunary, "queue", events)
+    return events
+
+
+def test_chain_input_arg(tracked, monkeypatch):
+    @lunary.chain(input_arg="question")
+    def answer(context, question, style="short"):
+        return f"{question}?"
+
+    inspected = []
+    monkeypatch.setattr(lunary, "signature", lambda fn: inspected.append(fn))
+
+    assert answer("ctx", "why") == "why?"
+    assert answer("ctx", question="how") == "how?"
+    assert [event["input"] for event in tracked if event["event"] == "start"] == ["why", "how"]
+    assert [event["name"] for event in tracked] == ["answer"] * 4
+    assert inspected == []
+    assert answer.__name__ == "answer"
+
+    with pytest.raises(ValueError):
+        answer("ctx")
+
+
+def test_class_chain_app_id_per_instance(tracked):
+    class Agent:
+        def __init__(self, project):
+            self.project = project
+
+        @lunary.class_chain(app_id=lambda self: self.project, input_arg="query")
+        def run(self, query):
+            return query.upper()
+
+    assert Agent("a").run("x") == "X"
+    assert Agent("b").run(query="y") == "Y"
+    assert Agent("a").run("z") == "Z"
+
+    starts = [event for event in tracked if event["event"] == "start"]
+    assert [(event["appId"], event["input"]) for event in starts] == [("a", "x"), ("b", "y"), ("a", "z")]
+
+
+def test_chain_streams_only_when_asked(tracked):
+    @lunary.chain()
+    def answer(question, stream=False):
+        if not stream:
+            return question
+        delta = NS(content=question, role="assistant", tool_calls=None, function_call=None)
+        return (chunk for chunk in [NS(choices=[NS(index=0, delta=delta)], usage=None)])
+
+    assert [chunk.choices[0].delta.content for chunk in answer("a", stream=True)] == ["a"]
+    assert answer("b") == "b"
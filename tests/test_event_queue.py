@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import threading
+from collections import deque
+
+import pytest
+
+from lunary.config import DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL
+from lunary.event_queue import EventQueue
+from lunary.events import EncodedEvent
+from .conftest import make_events
+
+
+@pytest.fixture
+def queue_config(config, tmp_path):
+    config.max_queue_size = 3
+    config.max_queue_bytes = None
+    config.queue_block_timeout = 0.01
+    config.spill_dir = str(tmp_path)
+    return config
+
+
+def run_ids(batch):
+    return [json.loads(e.data)["runId"] if isinstance(e, EncodedEvent) else e["runId"] for e in batch]
+
+
+def test_drop_oldest(queue_config):
+    queue_config.queue_policy = DROP_OLDEST
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(5))
+
+    assert run_ids(queue.get_batch()) == ["2", "3", "4"]
+    assert queue.stats()["dropped"] == 2
+
+
+def test_drop_newest(queue_config):
+    queue_config.queue_policy = DROP_NEWEST
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(5))
+
+    assert run_ids(queue.get_batch()) == ["0", "1", "2"]
+    assert queue.stats()["dropped"] == 2
+
+
+def test_block_times_out(queue_config):
+    queue_config.queue_policy = BLOCK
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(4))
+
+    assert len(queue.get_batch()) == 3
+    assert queue.stats()["dropped"] == 1
+
+
+def test_offer_leaves_events_out_when_full(queue_config):
+    queue_config.queue_policy = DROP_OLDEST
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(2))
+
+    assert queue.offer({"event": "progress", "runId": "2"})
+    assert not queue.offer({"event": "progress", "runId": "3"})
+    assert run_ids(queue.get_batch()) == ["0", "1", "2"]
+
+
+def test_max_bytes(queue_config):
+    queue_config.queue_policy = DROP_OLDEST
+    queue_config.max_queue_size = None
+    queue_config.max_queue_bytes = 100
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(10))
+
+    stats = queue.stats()
+    assert 0 < stats["queued_bytes"] <= 100
+    assert stats["queued"] + stats["dropped"] == 10
+
+
+def test_spill_to_disk(queue_config):
+    queue_config.queue_policy = SPILL
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(5))
+
+    assert len(queue) == 5
+    assert queue.stats()["spilled"] == 2
+    assert run_ids(queue.get_batch()) == ["0", "1", "2", "3", "4"]
+    assert queue.stats()["spill_pending"] == 0
+
+
+def test_spill_outage_does_not_grow_the_file(queue_config, ingest_server, monkeypatch):
+    queue_config.queue_policy = SPILL
+    monkeypatch.setattr(queue_config, "max_queue_size", 100)
+    monkeypatch.setattr(queue_config, "api_url", ingest_server.url)
+    monkeypatch.setattr(queue_config, "app_id", "test-app-id")
+    monkeypatch.setattr(queue_config, "retry_base_delay", 0)
+    monkeypatch.setattr(queue_config, "sender_workers", 1)
+    ingest_server.respond = lambda events: 503
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(300))
+    size = os.path.getsize(queue.spill.path)
+
+    for _ in range(20):
+        queue.consumer.send_batch()
+    assert os.path.getsize(queue.spill.path) == size
+    stats = queue.stats()
+    assert (stats["spilled"], stats["spill_pending"], stats["dropped"]) == (200, 200, 0)
+
+    ingest_server.respond = lambda events: 200
+    assert queue.flush(timeout=5).pending == 0
+    assert sorted(int(e["runId"]) for e in ingest_server.events) == list(range(300))
+    assert not os.path.exists(queue.spill.path)
+
+
+def test_spill_quota(queue_config, monkeypatch):
+    queue_config.queue_policy = SPILL
+    monkeypatch.setattr(queue_config, "spill_max_bytes", 200)
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(20))
+
+    stats = queue.stats()
+    assert stats["spilled"] > 0 and stats["dropped"] > 0
+    assert stats["queued"] + stats["spilled"] + stats["dropped"] == 20
+    assert os.path.getsize(queue.spill.path) <= 200
+
+
+@pytest.mark.skipif(os.name != "posix", reason="stale spill files are only detected on POSIX")
+def test_stale_spill_files_are_removed(queue_config):
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    stale = os.path.join(queue_config.spill_dir, f"lunary-spill-{int(dead.stdout)}.jsonl")
+    alive = os.path.join(queue_config.spill_dir, f"lunary-spill-{os.getppid()}.jsonl")
+    for path in (stale, alive):
+        with open(path, "w") as file:
+            file.write("[null, null]\t{}\n")
+
+    queue_config.queue_policy = SPILL
+    EventQueue(start_consumer=False).append(make_events(5))
+
+    assert not os.path.exists(stale)
+    assert os.path.exists(alive)
+
+
+def test_requeue_keeps_order(queue_config):
+    queue_config.queue_policy = DROP_OLDEST
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(2))
+    batch = queue.get_batch()
+    queue.append({"event": "start", "runId": "new"})
+    queue.requeue(batch)
+
+    assert run_ids(queue.get_batch()) == ["0", "1", "new"]
+
+
+def test_serialize_on_enqueue(queue_config):
+    queue_config.serialize_on_enqueue = True
+    try:
+        queue = EventQueue(start_consumer=False)
+        event = {"event": "start", "runId": "0", "input": ["mutable"]}
+        queue.append(event)
+        deadline = time.monotonic() + 1
+        while len(queue) == 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        event["input"].append("changed later")
+
+        batch = queue.get_batch()
+        assert isinstance(batch[0], EncodedEvent)
+        assert json.loads(batch[0].data)["input"] == ["mutable"]
+    finally:
+        queue_config.serialize_on_enqueue = False
+
+
+def test_serialize_on_enqueue_unbounded(queue_config):
+    queue_config.serialize_on_enqueue = True
+    queue_config.max_queue_size = None
+    try:
+        queue = EventQueue(start_consumer=False)
+        queue.append(make_events(3))
+        assert queue.get_encoder().drain(1)
+
+        assert run_ids(queue.get_batch()) == ["0", "1", "2"]
+    finally:
+        queue_config.serialize_on_enqueue = False
+
+
+def test_concurrent_append_and_drain(queue_config):
+    queue_config.max_queue_size = None
+    queue = EventQueue(start_consumer=False)
+    threads = [
+        threading.Thread(target=lambda t=t: [queue.append({"runId": f"{t}-{i}"}) for i in range(2000)])
+        for t in range(8)
+    ]
+    drained = []
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        drained += queue.get_batch()
+    drained += queue.get_batch()
+
+    assert len(drained) == 8 * 2000
+    assert len(set(run_ids(drained))) == 8 * 2000
+    for t in range(8):
+        ids = [run_id for run_id in run_ids(drained) if run_id.startswith(f"{t}-")]
+        assert ids == [f"{t}-{i}" for i in range(2000)]
+
+
+def test_append_while_draining_starts_the_timer(queue_config):
+    """The consumer drains the queue between the unlocked length check and the append"""
+    queue_config.max_queue_size = None
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(1))
+
+    class DrainedBeforeExtend(deque):
+        def extend(self, events):
+            queue.get_batch()
+            super().extend(events)
+
+    woken = []
+    queue.waker = lambda: woken.append(queue.first_event_at)
+    queue.events = DrainedBeforeExtend(queue.events)
+    queue.append(make_events(1))
+
+    # The consumer, waiting without a timeout on the empty queue, is woken and its timer started
+    assert len(queue) == 1
+    assert len(woken) == 1 and woken[0] is not None
@@ -0,0 +1,19 @@
+import json
+from lunary.events import Event, encode_event, event_route
+from lunary.serializers import create_serializer
+
+
+def test_event_layout():
+    event = Event(event="start", type="llm", run_id="run-1", name=None, app_id="app-1")
+    event.api_url = "http://localhost:3333"
+
+    fields = event.to_dict()
+    assert len(fields) == 21 and "apiUrl" not in fields
+    assert {k: v for k, v in fields.items() if v is not None} == {"event": "start", "type": "llm", "runId": "run-1", "appId": "app-1"}
+    assert event["runId"] == "run-1"
+    assert event.get("name") is None
+    assert event_route(event) == ("app-1", "http://localhost:3333")
+
+    encoded = encode_event(event, create_serializer("json"))
+    assert json.loads(encoded.data) == event.to_dict()
+    assert (encoded.app_id, encoded.api_url) == ("app-1", "http://localhost:3333")
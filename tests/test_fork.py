@@ -0,0 +1,31 @@
+import os
+import time
+
+import pytest
+
+import lunary
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_events_sent_from_forked_child(ingest_config, ingest_server):
+    """Like with gunicorn --preload: the parent started its consumer before forking"""
+    lunary.track_event("chain", "start", run_id="parent-run", name="parent")
+    assert lunary.flush(timeout=5).pending == 0
+    assert lunary.queue.consumer.is_alive()
+
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            lunary.track_event("chain", "start", run_id="child-run", name="child")
+            # No flush: the child's own consumer thread must send the event
+            deadline = time.monotonic() + 5
+            while lunary.queue.stats()["sent"] == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            code = 0 if lunary.queue.stats()["sent"] == 1 else 1
+        finally:
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert [e["name"] for e in ingest_server.events] == ["parent", "child"]
@@ -0,0 +1,254 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+import lunary
+from lunary.run_manager import RunManager
+from lunary.sampling import decide, sampled_runs, unsampled_runs
+from lunary.tail_sampling import trace_buffer
+
+
+class Recorder(list):
+    def append(self, event):
+        super().append(event.to_dict() if hasattr(event, "to_dict") else event)
+
+    def flush(self, timeout):
+        pass
+
+
+@pytest.fixture
+def tracked(config, monkeypatch):
+    config.app_id = "project"
+    events = Recorder()
+    monkeypatch.setattr(lunary, "queue", events)
+    yield config, events
+    unsampled_runs.clear()
+    sampled_runs.clear()
+
+
+def test_decisions_are_consistent():
+    trace_ids = [f"trace-{i}" for i in range(10000)]
+    kept = [trace_id for trace_id in trace_ids if decide(trace_id, 0.1)]
+
+    assert 800 < len(kept) < 1200
+    assert kept == [trace_id for trace_id in trace_ids if decide(trace_id, 0.1)]
+    assert all(decide(trace_id, 0.5) for trace_id in kept)
+
+
+def test_unsampled_trace_is_skipped(tracked):
+    config, events = tracked
+    config.sample_rate = 0
+    parsed = []
+
+    def parse_input(*args, **kwargs):
+        parsed.append(args)
+        return {"input": args, "name": "child"}
+
+    child = lunary.wrap(lambda x: x * 2, "tool", input_parser=parse_input)
+    root = lunary.wrap(lambda x, **kwargs: child(x) + 1, "agent", name="root", input_parser=parse_input)
+
+    assert root(1, user_id="user", tags=["t"]) == 3
+    assert events == []
+    assert parsed == []
+
+    lunary.track_feedback(next(iter(unsampled_runs.run_ids)), {"thumbs": "up"})
+    assert events == []
+
+
+def test_late_feedback_follows_the_trace(tracked):
+    config, events = tracked
+    config.sample_rate = 0.5
+    config.sampling_cache_size = 10
+    roots = []
+
+    def agent():
+        roots.append(lunary.run_manager.current_run_id)
+        return child()
+
+    child = lunary.wrap(lambda: "done", "tool", name="child")
+    root = lunary.wrap(agent, "agent", name="root")
+    for _ in range(100):
+        root()
+    kept = [run_id for run_id in roots if decide(run_id, 0.5)]
+    assert len(events) == 4 * len(kept)
+    assert len(unsampled_runs) == len(sampled_runs) == 10
+
+    # The decisions for the first traces were evicted: taken again from the run id
+    events.clear()
+    for run_id in roots:
+        lunary.track_feedback(run_id, {"thumbs": "up"})
+    assert len(events) == len(kept)
+
+    # The children of recent traces follow them
+    events.clear()
+    for run_id in list(sampled_runs.run_ids) + list(unsampled_runs.run_ids):
+        lunary.track_feedback(run_id, {"thumbs": "up"})
+    assert len(events) == 10
+
+
+def test_rules_apply_to_the_whole_trace(tracked):
+    config, events = tracked
+    config.sample_rate = 0
+    config.sampling_rules = {"name:kept": 1}
+
+    child = lunary.wrap(lambda: "done", "tool", name="other")
+    lunary.wrap(lambda: child(), "agent", name="kept")()
+    lunary.wrap(lambda: child(), "agent", name="dropped")()
+
+    assert [(event["name"], event["event"]) for event in events] == [
+        ("kept", "start"),
+        ("other", "start"),
+        ("other", "end"),
+        ("kept", "end"),
+    ]
+    assert events[1]["parentRunId"] == events[0]["runId"]
+
+
+def test_thread_messages_follow_the_thread(tracked):
+    config, events = tracked
+    config.sample_rate = 0.5
+    threads = [lunary.open_thread(f"thread-{i}") for i in range(20)]
+
+    for thread in threads:
+        for _ in range(3):
+            message_id = thread.track_message({"role": "user", "content": "hi"})
+            lunary.track_feedback(message_id, {"thumbs": "up"})
+
+    per_thread = {}
+    for event in events:
+        if event["type"] == "thread":
+            per_thread[event["parentRunId"]] = per_thread.get(event["parentRunId"], 0) + 1
+    assert 0 < len(per_thread) < 20
+    assert set(per_thread.values()) == {3}
+    assert len([event for event in events if event["event"] == "feedback"]) == 3 * len(per_thread)
+
+
+@pytest.fixture
+def tail_sampled(tracked, monkeypatch):
+    config, events = tracked
+    # Runs left open by other tests would be the parents of the traces started here
+    monkeypatch.setattr(lunary, "run_manager", RunManager())
+    config.tail_sampling = True
+    yield config, events
+    trace_buffer.release_all()
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def test_tail_sampling_keeps_errored_traces(tail_sampled):
+    config, events = tail_sampled
+    failing = lunary.wrap(fail, "tool", name="failing")
+    succeeding = lunary.wrap(lambda: "done", "tool", name="succeeding")
+
+    def errored():
+        try:
+            failing()
+        except ValueError:
+            return "recovered"
+
+    lunary.wrap(errored, "agent", name="errored")()
+    assert [event["name"] for event in events if event["event"] == "start"] == ["errored", "failing"]
+
+    root = lunary.wrap(lambda: succeeding(), "agent", name="ok")
+    root()
+    assert len(events) == 4
+    assert len(trace_buffer) == 0
+
+    # The decision holds for the events reported afterwards
+    lunary.track_feedback(next(iter(unsampled_runs.run_ids)), {"thumbs": "down"})
+    assert len(events) == 4
+
+
+def test_tail_sampling_thresholds(tail_sampled):
+    config, events = tail_sampled
+    config.tail_tokens_threshold = 100
+    parse_output = lambda output, stream: {"output": output, "tokensUsage": {"prompt": output, "completion": output}}
+    llm = lunary.wrap(lambda tokens: tokens, "llm", name="llm", output_parser=parse_output)
+
+    lunary.wrap(lambda: llm(10), "agent", name="cheap")()
+    lunary.wrap(lambda: llm(10) + llm(40), "agent", name="expensive")()
+    assert {event["name"] for event in events} == {"expensive", "llm"}
+
+    config.tail_latency_threshold = 0
+    lunary.wrap(lambda: llm(1), "agent", name="slow")()
+    assert events[-1]["name"] == "slow"
+
+
+def test_tail_sampling_memory_cap(tail_sampled):
+    config, events = tail_sampled
+    config.tail_max_events = 3
+
+    def step():
+        assert events == [] or events[0]["event"] == "start"
+    root = lunary.wrap(lambda: [lunary.wrap(step, "tool", name="step")() for _ in range(3)], "agent", name="long")
+    config.tail_latency_threshold = 0
+    root()
+
+    # Decided early, once over the cap: the events that follow are sent as they come
+    assert [event["event"] for event in events] == ["start", "start", "end", "start", "end", "start", "end", "end"]
+    assert len(trace_buffer) == 0
+
+
+def test_tail_sampling_times_out_quiet_traces(tail_sampled, monkeypatch):
+    config, events = tail_sampled
+    monkeypatch.setattr(config, "tail_trace_timeout", 0.1)
+    lunary.run_manager.start_run("stuck-root")
+    lunary.track_event("agent", "start", run_id="stuck-root", name="stuck")
+    lunary.run_manager.start_run("stuck-child")
+    lunary.track_event("tool", "error", run_id="stuck-child", parent_run_id="stuck-root", error={"message": "failed"})
+    assert events == []
+
+    deadline = time.monotonic() + 5
+    while len(trace_buffer) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [event["event"] for event in events] == ["start", "error"]
+    lunary.run_manager.end_run("stuck-root")
+
+
+def test_flush_keeps_running_traces(tail_sampled):
+    config, events = tail_sampled
+    lunary.run_manager.start_run("running-root")
+    lunary.track_event("agent", "start", run_id="running-root", name="running")
+    lunary.flush(timeout=0)
+    assert len(trace_buffer) == 1
+
+    lunary.track_event("agent", "error", run_id="running-root", error={"message": "failed"})
+    lunary.run_manager.end_run("running-root")
+    assert [event["event"] for event in events] == ["start", "error"]
+
+
+def test_held_traces_sent_at_exit(ingest_server):
+    script = "\n".join([
+        "import lunary",
+        "lunary.run_manager.start_run('exit-root')",
+        "lunary.track_event('agent', 'start', run_id='exit-root', name='root')",
+        "lunary.run_manager.start_run('exit-child')",
+        "lunary.track_event('tool', 'start', run_id='exit-child', parent_run_id='exit-root', name='child')",
+        "lunary.track_event('tool', 'error', run_id='exit-child', parent_run_id='exit-root', error={'message': 'failed'})",
+    ])
+    env = {
+        **os.environ,
+        "LUNARY_API_URL": ingest_server.url,
+        "LUNARY_APP_ID": "test-app-id",
+        "LUNARY_TAIL_SAMPLING": "1",
+        "LUNARY_FLUSH_INTERVAL": "60",
+    }
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, timeout=30)
+
+    assert [event["event"] for event in ingest_server.events] == ["start", "start", "error"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_locks_reset_after_fork():
+    with trace_buffer.lock, unsampled_runs.lock:
+        pid = os.fork()
+        if pid == 0:
+            acquired = trace_buffer.lock.acquire(timeout=1) and unsampled_runs.lock.acquire(timeout=1)
+            os._exit(0 if acquired else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
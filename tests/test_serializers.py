@@ -0,0 +1,55 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import BaseModel
+
+from lunary.serializers import SERIALIZERS, Serializer, create_serializer, orjson
+
+
+class Function(BaseModel):
+    name: str
+    arguments: str
+
+
+class Custom:
+    def __init__(self):
+        self.value = {1, 2}
+
+
+EVENT = {
+    "event": "end",
+    "runId": uuid.UUID("12345678123456781234567812345678"),
+    "timestamp": datetime(2024, 1, 1, tzinfo=timezone.utc),
+    "output": {"content": "héllo", "tool_calls": [Function(name="f", arguments="{}")]},
+    "metadata": {"tags": ("a", "b"), "custom": Custom()},
+}
+
+
+@pytest.mark.parametrize("name", [name for name in SERIALIZERS if name != "jsonpickle"])
+def test_fast_serializers(name):
+    if name == "orjson" and orjson is None:
+        pytest.skip("orjson is not installed")
+
+    decoded = json.loads(create_serializer(name).dumps(EVENT))
+    assert decoded == {
+        "event": "end",
+        "runId": "12345678-1234-5678-1234-567812345678",
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "output": {"content": "héllo", "tool_calls": [{"name": "f", "arguments": "{}"}]},
+        "metadata": {"tags": ["a", "b"], "custom": {"value": [1, 2]}},
+    }
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        create_serializer("pickle")
+
+
+def test_serializer_requires_dumps():
+    class Incomplete(Serializer):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,16 @@
+from lunary.session import get_session
+
+
+def test_session_is_reused():
+    """The same pooled session is shared between calls"""
+    assert get_session() is get_session()
+
+
+def test_session_rebuilt_when_pool_size_changes(config):
+    """Changing the pool size gives a new session with a bounded adapter"""
+    previous_size = config.http_pool_size
+    first = get_session()
+    config.http_pool_size = previous_size + 1
+    second = get_session()
+    assert second is not first
+    assert second.get_adapter("https://api.lunary.ai")._pool_maxsize == previous_size + 1
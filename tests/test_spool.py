@@ -0,0 +1,88 @@
+import json
+import pytest
+from lunary import spool
+from lunary.event_queue import EventQueue
+from .conftest import make_events
+
+
+@pytest.fixture
+def spool_config(ingest_config, tmp_path):
+    ingest_config.spool_dir = str(tmp_path / "spool")
+    return ingest_config
+
+
+def restart(queue):
+    """Simulates a crash: the spool is closed without sending anything."""
+    queue.spool.close()
+    return EventQueue(start_consumer=False)
+
+
+def test_events_survive_restart(spool_config, ingest_server):
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(3))
+    assert len(queue) == 3
+
+    queue = restart(queue)
+    assert len(queue) == 3
+    queue.consumer.send_batch()
+    assert [e["runId"] for e in ingest_server.events] == ["0", "1", "2"]
+
+    queue = restart(queue)
+    assert len(queue) == 0
+
+
+def test_failed_events_are_not_committed(spool_config, ingest_server):
+    ingest_server.respond = lambda events: 503
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(3))
+    queue.consumer.send_batch()
+    assert len(queue) == 3
+
+    queue = restart(queue)
+    assert len(queue) == 3
+
+
+def test_quota_drops_oldest_segments(spool_config, monkeypatch):
+    monkeypatch.setattr(spool, "SEGMENT_BYTES", 500)
+    spool_config.spool_max_bytes = 2000
+    queue = EventQueue(start_consumer=False)
+    for i in range(100):
+        queue.append({"event": "start", "runId": str(i)})
+
+    stats = queue.stats()
+    assert stats["spool_dropped"] > 0
+    assert stats["spooled"] + stats["spool_dropped"] + stats["dropped"] == 100
+    run_ids = [json.loads(e.data)["runId"] for e in queue.get_batch()]
+    assert run_ids == [str(i) for i in range(100 - len(run_ids), 100)]
+
+
+def test_torn_record_is_skipped(spool_config):
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(2))
+    path = queue.spool._path(queue.spool.write_seq)
+    queue.spool.close()
+    with open(path, "ab") as file:
+        file.write(b"\x40\x00\x00\x00\x00\x00\x00\x00{\"event\"")
+
+    queue = EventQueue(start_consumer=False)
+    assert [json.loads(e.data)["runId"] for e in queue.get_batch()] == ["0", "1"]
+
+
+@pytest.mark.parametrize("sender_workers", [1, 4])
+def test_outage_keeps_spooled_events_on_disk(spool_config, ingest_server, monkeypatch, sender_workers):
+    monkeypatch.setattr(spool_config, "max_queue_size", 100)
+    monkeypatch.setattr(spool_config, "retry_base_delay", 0)
+    monkeypatch.setattr(spool_config, "sender_workers", sender_workers)
+    ingest_server.respond = lambda events: 503
+    queue = EventQueue(start_consumer=False)
+    queue.append(make_events(1000))
+
+    for _ in range(12):
+        queue.consumer.send_batch()
+    stats = queue.stats()
+    assert (stats["queued"], stats["spooled"], stats["dropped"]) == (0, 1000, 0)
+
+    ingest_server.respond = lambda events: 200
+    assert queue.flush(timeout=5).pending == 0
+    assert sorted(int(e["runId"]) for e in ingest_server.events) == list(range(1000))
+    assert len(restart(queue)) == 0
@@ -0,0 +1,142 @@
+import time
+from types import SimpleNamespace as NS
+
+import lunary
+from lunary.streaming import StreamAccumulator, drain_finisher
+
+
+def chunk(content=None, role=None, tool_calls=None, function_call=None, index=0):
+    delta = NS(content=content, role=role, tool_calls=tool_calls, function_call=function_call)
+    return NS(choices=[NS(index=index, delta=delta)], usage=None)
+
+
+def tool_call(index, id=None, name=None, arguments=None):
+    return NS(index=index, id=id, type="function" if id else None, function=NS(name=name, arguments=arguments))
+
+
+class Stream(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_accumulates_content_and_parallel_tool_calls():
+    accumulator = StreamAccumulator()
+    for c in [
+        NS(choices=[]),
+        chunk(role="assistant", content=""),
+        chunk(content="Hel"),
+        chunk(content="lo"),
+        chunk(tool_calls=[tool_call(0, "call_a", "search", ""), tool_call(1, "call_b", "fetch", "")]),
+        chunk(tool_calls=[tool_call(1, arguments='{"url"')]),
+        chunk(tool_calls=[tool_call(0, arguments='{"q": 1}')]),
+        chunk(tool_calls=[tool_call(1, arguments=': "x"}')]),
+    ]:
+        accumulator.add(c)
+
+    message = accumulator.message()
+    assert message["role"] == "assistant"
+    assert message["content"] == "Hello"
+    assert message["function_call"] == {}
+    assert message["tool_calls"] == [
+        {"index": 0, "id": "call_a", "function": {"arguments": '{"q": 1}', "name": "search"}, "type": "function"},
+        {"index": 1, "id": "call_b", "function": {"arguments": '{"url": "x"}', "name": "fetch"}, "type": "function"},
+    ]
+    assert accumulator.chunks == 8
+
+
+def test_accumulates_function_call_per_choice():
+    accumulator = StreamAccumulator()
+    accumulator.add(chunk(role="assistant", function_call=NS(name="lookup", arguments="")))
+    accumulator.add(chunk(function_call=NS(name=None, arguments='{"id": 1}')))
+    accumulator.add(chunk(role="assistant", content="other", index=1))
+
+    assert accumulator.message()["function_call"] == {"name": "lookup", "arguments": '{"id": 1}'}
+    assert accumulator.message(1)["content"] == "other"
+    assert accumulator.message(2)["content"] == ""
+
+
+def test_stream_handler_tracks_the_joined_output(monkeypatch):
+    tracked = []
+    monkeypatch.setattr(lunary, "track_event", lambda *args, **kwargs: tracked.append(kwargs))
+    stream = Stream([chunk(role="assistant", content=word) for word in ("a", "b", "c")])
+
+    chunks = list(lunary.default_stream_handler(lambda: stream, "run", "gpt-4o", "llm"))
+
+    assert chunks == stream
+    assert stream.closed
+    assert tracked[0]["output"]["content"] == "abc"
+    assert tracked[0]["token_usage"] == {"completion": None, "prompt": None}
+    assert tracked[0]["metadata"]["streaming"]["chunks"] == 3
+
+
+def test_stream_handler_reports_usage_and_timings(monkeypatch):
+    tracked = []
+    monkeypatch.setattr(lunary, "track_event", lambda *args, **kwargs: tracked.append(kwargs))
+
+    def stream():
+        time.sleep(0.05)
+        for word in ("a", "b", "c"):
+            yield chunk(role="assistant", content=word)
+            time.sleep(0.01)
+        yield NS(choices=[], usage=NS(completion_tokens=3, prompt_tokens=12))
+
+    list(lunary.default_stream_handler(stream, "run", "gpt-4o", "llm"))
+
+    assert tracked[0]["token_usage"] == {"completion": 3, "prompt": 12}
+    timings = tracked[0]["metadata"]["streaming"]
+    assert timings["timeToFirstTokenMs"] >= 50
+    assert 10 <= timings["interTokenLatencyMs"]["p50"] <= timings["interTokenLatencyMs"]["p99"]
+    assert timings["durationMs"] >= timings["timeToFirstTokenMs"] + 20
+
+
+def test_stream_progress_is_throttled_and_coalesced(monkeypatch):
+    tracked = []
+    monkeypatch.setattr(lunary, "track_event", lambda *args, **kwargs: tracked.append((args[1], kwargs)))
+    config = lunary.get_config()
+    monkeypatch.setattr(config, "stream_progress_interval", 0.02)
+
+    def stream():
+        for i in range(10):
+            yield chunk(role="assistant", content=str(i))
+            time.sleep(0.005)
+
+    list(lunary.default_stream_handler(stream, "run", "gpt-4o", "llm"))
+
+    progress = [kwargs for event, kwargs in tracked if event == "progress"]
+    assert 1 <= len(progress) <= 3
+    offset = 0
+    for kwargs in progress:
+        assert kwargs["metadata"]["streaming"]["offset"] == offset
+        offset += len(kwargs["output"]["content"])
+    assert "".join(kwargs["output"]["content"] for kwargs in progress) == "0123456789"[:offset]
+    assert tracked[-1][0] == "end" and tracked[-1][1]["output"]["content"] == "0123456789"
+
+
+
+def recorded_stream():
+    yield chunk(role="assistant", content="")
+    for word in ("Hel", "lo"):
+        yield chunk(content=word)
+    yield chunk(tool_calls=[tool_call(0, "call_a", "search", "")])
+    yield chunk(tool_calls=[tool_call(0, arguments='{"q": 1}')])
+    yield NS(choices=[], usage=NS(completion_tokens=5, prompt_tokens=12))
+
+
+def test_passthrough_tracks_the_same_output_in_the_background(monkeypatch):
+    tracked = []
+    monkeypatch.setattr(lunary, "track_event", lambda *args, **kwargs: tracked.append(kwargs))
+    config = lunary.get_config()
+    expected = list(lunary.default_stream_handler(recorded_stream, "run", "gpt-4o", "llm"))
+
+    for mode in ("chunks", "deltas"):
+        monkeypatch.setattr(config, "stream_passthrough", mode)
+        assert list(lunary.default_stream_handler(recorded_stream, "run", "gpt-4o", "llm")) == expected
+        assert drain_finisher(1)
+
+    parsed, chunks, deltas = tracked
+    for passthrough in (chunks, deltas):
+        assert passthrough["output"] == parsed["output"]
+        assert passthrough["token_usage"] == {"completion": 5, "prompt": 12}
+        assert passthrough["metadata"]["streaming"]["chunks"] == 6
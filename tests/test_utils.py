@@ -0,0 +1,13 @@
+import uuid
+import hashlib
+from lunary.utils import create_uuid_from_string, derive_run_id
+
+
+def test_run_ids_are_unchanged():
+    for seed in ["run-1", "4b3b3c1e-0f6d-4b5e-9a8e-2f0c6d1e5a7b", "ünïcode"]:
+        expected = uuid.UUID(hashlib.sha256(seed.encode("utf-8")).hexdigest()[:32])
+        assert create_uuid_from_string(seed) == expected
+
+    assert derive_run_id("run-1", "project") == str(create_uuid_from_string("run-1project"))
+    assert derive_run_id("run-1", "project") == derive_run_id("run-1", "project")
+    assert derive_run_id("run-1", "project") != derive_run_id("run-1", "other-project")